@@ -0,0 +1,471 @@
+"""Бенчмарки слоя хранения бота.
+
+Запуск: python benchmark.py <сценарий> [параметры]
+Все сценарии работают со временной базой и не трогают bot.db.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from completed_index import CompletedTasksIndex
+from database import Database
+from storage import StorageProfile
+from task_cards import build_task_card, render_task_card
+from task_catalog import TaskCatalog
+
+
+class BlockingDatabase(Database):
+    """Прежнее поведение: запросы выполняются прямо в event loop"""
+
+    async def _write(self, func, *args):
+        return func(self.conn, *args)
+
+    async def _read(self, func, *args):
+        return func(self.conn, *args)
+
+
+class SerializedDatabase(Database):
+    """Одно соединение на чтение и запись: чтения ждут в очереди за записями"""
+
+    async def _read(self, func, *args):
+        return await self._write(func, *args)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _seed_tasks(db, count):
+    for i in range(count):
+        await db.add_task('subscribe', f'Задание {i}', 1.0, {'channel_link': f'https://t.me/ch{i}'})
+
+
+async def _handlers_load(db, users, rounds):
+    """Имитирует обработчики: список заданий, баланс, начисление"""
+    lags = []
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        # Задержка тика показывает, насколько заблокирован event loop
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    async def handler(user_id):
+        for _ in range(rounds):
+            await db.get_available_tasks(user_id)
+            await db.get_balance(user_id)
+            await db.update_balance(user_id, 1.0)
+
+    ticker = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, lags
+
+
+def bench_async_db(args):
+    for cls in (BlockingDatabase, Database):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = cls(os.path.join(tmp, 'bench.db'))
+
+            async def scenario():
+                await _seed_tasks(db, args.tasks)
+                return await _handlers_load(db, args.users, args.rounds)
+
+            elapsed, lags = asyncio.run(scenario())
+            db.close()
+
+        handled = args.users * args.rounds
+        print(
+            f"{cls.__name__:>16}: {handled / elapsed:8.0f} обработчиков/с, "
+            f"задержка loop p99 {_percentile(lags, 0.99) * 1000:6.2f} мс, "
+            f"max {max(lags, default=0) * 1000:6.2f} мс"
+        )
+
+
+def _seed_completions(path, first_user, last_user, task_ids, per_user):
+    """Быстро заполняет completed_tasks напрямую, минуя Database"""
+    conn = sqlite3.connect(path)
+    rows = []
+    for user_id in range(first_user, last_user + 1):
+        for task_id in random.sample(task_ids, random.randint(0, per_user * 2)):
+            rows.append((user_id, task_id, 'completed'))
+    conn.executemany('INSERT OR IGNORE INTO users (user_id) VALUES (?)',
+                     ((u,) for u in range(first_user, last_user + 1)))
+    conn.executemany('INSERT OR IGNORE INTO completed_tasks (user_id, task_id, status) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+# Поиск доступных заданий в SQL, как до каталога заданий (user-007): на нём
+# видна работа индексов completed_tasks и tasks
+AVAILABLE_TASKS_SQL = '''
+    SELECT t.* FROM tasks t
+    LEFT JOIN completed_tasks ct ON t.id = ct.task_id AND ct.user_id = ?
+    WHERE t.is_active = 1 AND ct.task_id IS NULL
+    ORDER BY t.order_num
+'''
+
+
+def _grow_completions(args, path, measure):
+    """Наращивает completed_tasks по шагам и после каждого шага печатает задержку measure(users)"""
+    task_ids = list(range(1, args.tasks + 1))
+    loaded = 0
+    for step in range(1, args.steps + 1):
+        users = args.users * step // args.steps
+        _seed_completions(path, loaded + 1, users, task_ids, args.per_user)
+        loaded = users
+        samples = measure(users)
+        print(
+            f"{users:>8} пользователей: p50 {_percentile(samples, 0.5) * 1000:7.3f} мс, "
+            f"p99 {_percentile(samples, 0.99) * 1000:7.3f} мс"
+        )
+
+
+def bench_task_lookup(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        asyncio.run(_seed_tasks(db, args.tasks))
+        db.close()
+
+        conn = sqlite3.connect(path)
+        if args.no_indexes:
+            conn.execute('DROP INDEX IF EXISTS idx_completed_tasks_user_task')
+            conn.execute('DROP INDEX IF EXISTS idx_completed_tasks_task_user')
+            conn.execute('DROP INDEX IF EXISTS idx_tasks_active_order')
+
+        def measure(users):
+            samples = []
+            for user_id in random.sample(range(1, users + 1), min(args.samples, users)):
+                started = time.perf_counter()
+                conn.execute(AVAILABLE_TASKS_SQL, (user_id,)).fetchall()
+                conn.execute(AVAILABLE_TASKS_SQL + ' LIMIT 1', (user_id,)).fetchone()
+                samples.append(time.perf_counter() - started)
+            return samples
+
+        _grow_completions(args, path, measure)
+        conn.close()
+
+
+def bench_task_catalog(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        asyncio.run(_seed_tasks(db, args.tasks))
+
+        async def lookups(users):
+            samples = []
+            for user_id in random.sample(range(1, users + 1), min(args.samples, users)):
+                started = time.perf_counter()
+                await db.get_available_tasks(user_id)
+                await db.get_next_available_task(user_id)
+                samples.append(time.perf_counter() - started)
+            return samples
+
+        _grow_completions(args, path, lambda users: asyncio.run(lookups(users)))
+        db.close()
+
+
+def bench_read_pool(args):
+    setups = {
+        'одно соединение': (SerializedDatabase, StorageProfile(
+            journal_mode='DELETE', synchronous='FULL', mmap_size=0, cache_size=-2000
+        )),
+        'WAL + пул чтения': (Database, StorageProfile()),
+    }
+    for name, (cls, profile) in setups.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = cls(os.path.join(tmp, 'bench.db'), profile)
+
+            async def scenario():
+                latencies = []
+                stop = asyncio.Event()
+
+                async def writer(user_id):
+                    while not stop.is_set():
+                        await db.update_balance(user_id, 1.0)
+
+                async def reader(user_id):
+                    for _ in range(args.reads):
+                        started = time.perf_counter()
+                        # Мимо кэша балансов: меряем само чтение из базы
+                        await db._read(db._get_balance, user_id)
+                        latencies.append(time.perf_counter() - started)
+
+                writers = [asyncio.create_task(writer(user_id)) for user_id in range(args.writers)]
+                started = time.perf_counter()
+                await asyncio.gather(*(reader(user_id) for user_id in range(args.readers)))
+                elapsed = time.perf_counter() - started
+                stop.set()
+                await asyncio.gather(*writers)
+                return elapsed, latencies
+
+            elapsed, latencies = asyncio.run(scenario())
+            db.close()
+
+        print(
+            f"{name:>18}: {len(latencies) / elapsed:8.0f} чтений/с, "
+            f"p50 {_percentile(latencies, 0.5) * 1000:6.2f} мс, "
+            f"p99 {_percentile(latencies, 0.99) * 1000:6.2f} мс"
+        )
+
+
+def bench_group_commit(args):
+    setups = {
+        'commit на запись': StorageProfile(commit_window_ms=0, commit_max_batch=1, synchronous=args.synchronous),
+        'групповой commit': StorageProfile(synchronous=args.synchronous),
+    }
+    for name, profile in setups.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, 'bench.db'), profile)
+
+            async def scenario():
+                await _seed_tasks(db, 1)
+
+                async def complete(user_id):
+                    # Как в check_subscription: начисление и отметка о выполнении
+                    await db.update_balance(user_id, 1.0)
+                    await db.mark_task_completed(user_id, 1)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(complete(user_id) for user_id in range(1, args.completions + 1)))
+                return time.perf_counter() - started
+
+            elapsed = asyncio.run(scenario())
+            db.close()
+
+        writes = args.completions * 2
+        print(f"{name:>18}: {writes / elapsed:8.0f} записей/с ({args.completions} выполнений за {elapsed:.2f} с)")
+
+
+def bench_completed_index(args):
+    catalog = TaskCatalog([
+        {'id': task_id, 'type': 'subscribe', 'description': '', 'reward': 1.0,
+         'order_num': task_id, 'extra_data': {}, 'is_active': True}
+        for task_id in range(1, args.tasks + 1)
+    ])
+    task_ids = list(range(1, args.tasks + 1))
+
+    tracemalloc.start()
+    index = CompletedTasksIndex(args.max_users)
+    started = time.perf_counter()
+    for user_id in range(1, args.users + 1):
+        token = index.begin_load(user_id)
+        index.finish_load(user_id, token, random.sample(task_ids, random.randint(0, args.per_user * 2)))
+    load_time = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cached = index.stats()['size']
+    samples = []
+    for user_id in random.sample(range(args.users - cached + 1, args.users + 1), args.samples):
+        started = time.perf_counter()
+        catalog.available(index.get(user_id))
+        samples.append(time.perf_counter() - started)
+
+    print(f"Пользователей: {args.users}, в кэше: {cached}, вытеснено: {index.stats()['evictions']}")
+    print(f"Память: {memory / 1024 / 1024:.1f} МиБ ({memory / max(cached, 1):.0f} байт на пользователя)")
+    print(f"Прогрев: {args.users / load_time:.0f} пользователей/с")
+    print(
+        f"Доступные задания из маски: p50 {_percentile(samples, 0.5) * 1e6:.1f} мкс, "
+        f"p99 {_percentile(samples, 0.99) * 1e6:.1f} мкс"
+    )
+
+
+def bench_recipients(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = Database(path)
+        conn = sqlite3.connect(path)
+        conn.executemany('INSERT INTO users (user_id) VALUES (?)', ((u,) for u in range(1, args.users + 1)))
+        conn.commit()
+        conn.close()
+
+        async def full_list():
+            started = time.perf_counter()
+            users = await db.get_all_users()
+            first = time.perf_counter() - started
+            for _ in users:
+                pass
+            return first, time.perf_counter() - started
+
+        async def stream():
+            started = time.perf_counter()
+            first = None
+            async for _ in db.iter_user_ids(batch_size=args.batch_size):
+                if first is None:
+                    first = time.perf_counter() - started
+            return first, time.perf_counter() - started
+
+        for name, scenario in (('get_all_users', full_list), ('iter_user_ids', stream)):
+            tracemalloc.start()
+            first, total = asyncio.run(scenario())
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name:>14}: первый получатель через {first * 1000:8.2f} мс, "
+                f"все за {total:.2f} с, пик памяти {peak / 1024 / 1024:.1f} МиБ"
+            )
+        db.close()
+
+
+def bench_approvals(args):
+    """Одновременные нажатия «Принять» и «Проверить подписку», а также повторная
+    отправка скриншота не дают двойного начисления"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+
+        async def scenario():
+            await _seed_tasks(db, 2)
+            screenshot_task, subscribe_task = 1, 2
+            users = range(1, args.users + 1)
+            for user_id in users:
+                await db.save_screenshot(user_id, screenshot_task, file_id=f'file{user_id}')
+
+            async def approve(user_id, admin_id):
+                return await db.review_screenshots(admin_id, [(user_id, screenshot_task)], True)
+
+            clicks = [
+                approve(user_id, random.choice(args.admins))
+                for user_id in users for _ in range(args.clicks)
+            ] + [
+                db.complete_subscription_task(user_id, subscribe_task)
+                for user_id in users for _ in range(args.clicks)
+            ]
+            random.shuffle(clicks)
+            started = time.perf_counter()
+            await asyncio.gather(*clicks)
+            elapsed = time.perf_counter() - started
+
+            # Повторная отправка скриншота к принятому заданию и ещё одно «Принять»
+            resubmitted = 0
+            for user_id in users:
+                resubmitted += await db.save_screenshot(user_id, screenshot_task, file_id=f'again{user_id}')
+                await approve(user_id, random.choice(args.admins))
+            if resubmitted:
+                print(f"ОШИБКА: {resubmitted} принятых выполнений вернулись на проверку")
+
+            balances = [await db.get_balance(user_id) for user_id in users]
+            return elapsed, balances
+
+        elapsed, balances = asyncio.run(scenario())
+        ledger = db.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM balance_ledger WHERE reason LIKE 'task:%'"
+        ).fetchone()
+        stored = dict(db.conn.execute('SELECT user_id, balance FROM users').fetchall())
+        db.close()
+
+    expected = 2.0
+    wrong = [
+        user_id for user_id, balance in enumerate(balances, 1)
+        if balance != expected or stored.get(user_id) != expected
+    ]
+    print(
+        f"{args.users * args.clicks * 2} нажатий за {elapsed:.2f} с, "
+        f"начислений: {ledger[0]} на сумму {ledger[1]:.0f} (ожидалось {args.users * 2})"
+    )
+    if wrong or ledger[0] != args.users * 2:
+        raise SystemExit(f"ОШИБКА: неверный баланс у {len(wrong)} пользователей, например {wrong[:5]}")
+    print("OK: каждое задание оплачено ровно один раз")
+
+
+def bench_task_cards(args):
+    catalog = TaskCatalog([
+        {'id': task_id, 'type': 'subscribe' if task_id % 2 else 'register',
+         'description': f'Описание задания {task_id}', 'reward': 1.5, 'order_num': task_id,
+         'extra_data': {'channel_link': f'@channel{task_id}', 'reg_link': f'example.com/r/{task_id}'},
+         'is_active': True}
+        for task_id in range(1, args.tasks + 1)
+    ])
+    clicks = [random.choice(catalog.active) for _ in range(args.clicks)]
+
+    for name, render in (('сборка на каждый клик', build_task_card), ('кэш карточек', render_task_card)):
+        started = time.perf_counter()
+        for task in clicks:
+            render(task)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>22}: {elapsed / args.clicks * 1e6:6.2f} мкс на клик")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='scenario', required=True)
+
+    p = sub.add_parser('async-db', help='пропускная способность обработчиков до/после выноса БД в поток')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--rounds', type=int, default=5)
+    p.add_argument('--tasks', type=int, default=20)
+    p.set_defaults(func=bench_async_db)
+
+    p = sub.add_parser('task-lookup', help='задержка SQL-поиска доступных заданий по мере роста completed_tasks')
+    p.add_argument('--users', type=int, default=100_000)
+    p.add_argument('--tasks', type=int, default=200)
+    p.add_argument('--per-user', type=int, default=5, help='среднее число выполненных заданий')
+    p.add_argument('--steps', type=int, default=4)
+    p.add_argument('--samples', type=int, default=500)
+    p.add_argument('--no-indexes', action='store_true', help='замер без индексов для сравнения')
+    p.set_defaults(func=bench_task_lookup)
+
+    p = sub.add_parser('task-catalog', help='то же через каталог заданий и маски выполненных')
+    p.add_argument('--users', type=int, default=100_000)
+    p.add_argument('--tasks', type=int, default=200)
+    p.add_argument('--per-user', type=int, default=5, help='среднее число выполненных заданий')
+    p.add_argument('--steps', type=int, default=4)
+    p.add_argument('--samples', type=int, default=500)
+    p.set_defaults(func=bench_task_catalog)
+
+    p = sub.add_parser('read-pool', help='задержка чтения баланса под непрерывной записью')
+    p.add_argument('--readers', type=int, default=50)
+    p.add_argument('--reads', type=int, default=40)
+    p.add_argument('--writers', type=int, default=20)
+    p.set_defaults(func=bench_read_pool)
+
+    p = sub.add_parser('group-commit', help='записи в секунду при одновременных выполнениях заданий')
+    p.add_argument('--completions', type=int, default=1000)
+    p.add_argument('--synchronous', default='FULL', help='PRAGMA synchronous для обоих замеров')
+    p.set_defaults(func=bench_group_commit)
+
+    p = sub.add_parser('completed-index', help='память и задержка битовых масок выполненных заданий')
+    p.add_argument('--users', type=int, default=1_000_000)
+    p.add_argument('--max-users', type=int, default=1_000_000, help='размер LRU')
+    p.add_argument('--tasks', type=int, default=200)
+    p.add_argument('--per-user', type=int, default=5)
+    p.add_argument('--samples', type=int, default=10_000)
+    p.set_defaults(func=bench_completed_index)
+
+    p = sub.add_parser('recipients', help='список пользователей целиком против постраничного курсора')
+    p.add_argument('--users', type=int, default=1_000_000)
+    p.add_argument('--batch-size', type=int, default=1000)
+    p.set_defaults(func=bench_recipients)
+
+    p = sub.add_parser('approvals', help='стресс-проверка: повторные одобрения не начисляют награду дважды')
+    p.add_argument('--users', type=int, default=2000)
+    p.add_argument('--clicks', type=int, default=5, help='нажатий на одно задание')
+    p.add_argument('--admins', type=int, nargs='+', default=[1, 2, 3])
+    p.set_defaults(func=bench_approvals)
+
+    p = sub.add_parser('task-cards', help='стоимость отрисовки карточки задания на один клик')
+    p.add_argument('--tasks', type=int, default=50)
+    p.add_argument('--clicks', type=int, default=200_000)
+    p.set_defaults(func=bench_task_cards)
+
+    args = parser.parse_args()
+    random.seed(0)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
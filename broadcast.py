@@ -0,0 +1,272 @@
+"""Рассылка сообщений пользователям с учётом лимитов Telegram.
+
+Отправку выполняют несколько параллельных воркеров. Общая частота
+ограничена корзиной токенов (около 30 сообщений в секунду на бота),
+интервал между сообщениями в один чат — PerChatLimiter. На RetryAfter
+вся рассылка ставится на паузу на указанное время, временные сетевые
+ошибки повторяются с нарастающей задержкой.
+
+Рассылка хранится в базе как задание: результаты отправки пишутся
+пачками вместе с контрольной точкой — наибольшим user_id, до которого
+все получатели уже обработаны. После перезапуска рассылка продолжается
+с этой точки, повторно могут уйти только сообщения, которые были в
+отправке в момент остановки. Получатели с временной ошибкой повторяются
+по расписанию (retry_failed).
+"""
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from ratelimit import PerChatLimiter, TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastMessage:
+    """Что рассылаем: текст, фото или видео с подписью"""
+    kind: str
+    text: Optional[str] = None
+    file_id: Optional[str] = None
+
+    @classmethod
+    def from_message(cls, message: Message) -> 'BroadcastMessage':
+        if message.photo:
+            return cls('photo', message.caption, message.photo[-1].file_id)
+        if message.video:
+            return cls('video', message.caption, message.video.file_id)
+        return cls('text', message.text)
+
+    async def send(self, bot: Bot, chat_id: int):
+        if self.kind == 'photo':
+            await bot.send_photo(chat_id=chat_id, photo=self.file_id, caption=self.text, parse_mode='HTML')
+        elif self.kind == 'video':
+            await bot.send_video(chat_id=chat_id, video=self.file_id, caption=self.text, parse_mode='HTML')
+        else:
+            await bot.send_message(chat_id=chat_id, text=self.text, parse_mode='HTML')
+
+
+@dataclass
+class BroadcastJob:
+    id: int
+    message: BroadcastMessage
+    last_user_id: int = 0
+    total: int = 0
+    success: int = 0
+    failed: int = 0
+    admin_chat_id: Optional[int] = None
+    progress_message_id: Optional[int] = None
+    # Аргументы фильтра Database.iter_user_ids
+    segment: Dict = field(default_factory=dict)
+    # Сколько получателей пропущено, потому что они заблокировали бота
+    skipped: int = 0
+
+    @classmethod
+    def from_row(cls, row: Dict) -> 'BroadcastJob':
+        return cls(
+            id=row['id'],
+            message=BroadcastMessage(row['kind'], row['text'], row['file_id']),
+            last_user_id=row['last_user_id'],
+            total=row['total'],
+            success=row['success'],
+            failed=row['failed'],
+            admin_chat_id=row['admin_chat_id'],
+            progress_message_id=row['progress_message_id'],
+            segment=row['segment'],
+            skipped=row['skipped'],
+        )
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    success: int = 0
+    failed: int = 0
+    failed_users: List[int] = field(default_factory=list)
+    skipped: int = 0
+    done: bool = False
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.failed
+
+
+# BadRequest с такими текстами означает, что писать пользователю больше некуда
+DEAD_CHAT_ERRORS = ('chat not found', 'user is deactivated')
+
+
+def delivery_status(error: Optional[Exception]) -> str:
+    if error is None:
+        return 'sent'
+    if isinstance(error, Forbidden):
+        return 'dead'
+    if isinstance(error, BadRequest):
+        if any(text in str(error).lower() for text in DEAD_CHAT_ERRORS):
+            return 'dead'
+        # Ошибка в самом сообщении (разметка, длина, file_id): пользователь
+        # тут ни при чём, а повтор дал бы ту же ошибку
+        return 'rejected'
+    return 'failed'
+
+
+class BroadcastEngine:
+    def __init__(self, bot: Bot, db, rate: float = 25, concurrency: int = 20,
+                 max_retries: int = 3, progress_interval: float = 5.0, flush_size: int = 100,
+                 retry_delay_minutes: int = 10, max_attempts: int = 3):
+        self.bot = bot
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.chats = PerChatLimiter(1.0)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.flush_size = flush_size
+        self.retry_delay_minutes = retry_delay_minutes
+        self.max_attempts = max_attempts
+
+    async def deliver(self, message: BroadcastMessage, chat_id: int) -> Optional[Exception]:
+        """Отправляет одно сообщение с повторами; возвращает ошибку или None"""
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            await self.chats.wait(chat_id)
+            try:
+                await message.send(self.bot, chat_id)
+                return None
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                logger.warning(f"Флуд-лимит Telegram, пауза рассылки на {seconds} с")
+                self.bucket.pause(seconds)
+                error = e
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован, чат не найден или сообщение некорректно — повторять бессмысленно
+                return e
+            except NetworkError as e:
+                error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+            except TelegramError as e:
+                return e
+        return error
+
+    async def run(self, job: BroadcastJob,
+                  progress: Optional[Callable[[BroadcastStats], Awaitable]] = None) -> BroadcastStats:
+        """Отправляет рассылку начиная с контрольной точки задания"""
+        stats = BroadcastStats(total=job.total, success=job.success, failed=job.failed, skipped=job.skipped)
+        # После перезапуска пропускаем тех, чей результат записан уже после контрольной точки
+        recorded = await self.db.get_broadcast_recipients_after(job.id, job.last_user_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        # Контрольная точка: все получатели до неё включительно обработаны
+        checkpoint = job.last_user_id
+        in_flight = deque()
+        finished = set()
+        results = []
+        flush_lock = asyncio.Lock()
+
+        async def flush():
+            async with flush_lock:
+                batch = results[:]
+                del results[:]
+                # Начатая запись доводится до конца и при отмене: пачка уже
+                # убрана из results, а контрольная точка её учитывает
+                await asyncio.shield(self.db.save_broadcast_results(
+                    job.id, batch, last_user_id=checkpoint, retry_delay_minutes=self.retry_delay_minutes
+                ))
+
+        def complete(chat_id, error):
+            nonlocal checkpoint
+            results.append((chat_id, delivery_status(error), str(error) if error else None))
+            finished.add(chat_id)
+            while in_flight and in_flight[0] in finished:
+                finished.discard(in_flight[0])
+                checkpoint = in_flight.popleft()
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    error = await self.deliver(job.message, chat_id)
+                    if error is None:
+                        stats.success += 1
+                    else:
+                        stats.failed += 1
+                        stats.failed_users.append(chat_id)
+                        logger.error(f"Ошибка отправки пользователю {chat_id}: {error}")
+                    complete(chat_id, error)
+                    if len(results) >= self.flush_size:
+                        await flush()
+                finally:
+                    queue.task_done()
+
+        async def reporter():
+            while not stats.done:
+                await asyncio.sleep(self.progress_interval)
+                if not stats.done:
+                    try:
+                        await progress(stats)
+                    except Exception as e:
+                        logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        progress_task = asyncio.create_task(reporter()) if progress else None
+        try:
+            # Получатели читаются из базы постранично по мере отправки
+            async for chat_id in self.db.iter_user_ids(job.last_user_id, reachable_only=True, **job.segment):
+                if chat_id in recorded:
+                    continue
+                in_flight.append(chat_id)
+                await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await flush()
+            await self.db.finish_broadcast_job(job.id)
+        except asyncio.CancelledError:
+            # При остановке бота сохраняем всё, что успели отправить
+            for task in workers:
+                task.cancel()
+            await flush()
+            raise
+        finally:
+            stats.done = True
+            for task in workers:
+                task.cancel()
+            if progress_task:
+                progress_task.cancel()
+        return stats
+
+    async def retry_failed(self) -> int:
+        """Повторяет отправку получателям, для которых подошло время; возвращает число успешных"""
+        due = await self.db.get_due_broadcast_retries(self.max_attempts)
+        by_job: Dict[int, List[int]] = {}
+        for job_id, user_id in due:
+            by_job.setdefault(job_id, []).append(user_id)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(message, user_id):
+            async with semaphore:
+                return await self.deliver(message, user_id)
+
+        delivered = 0
+        for job_id, user_ids in by_job.items():
+            job = BroadcastJob.from_row(await self.db.get_broadcast_job(job_id))
+            errors = await asyncio.gather(*(deliver(job.message, user_id) for user_id in user_ids))
+            results = [
+                (user_id, delivery_status(error), str(error) if error else None)
+                for user_id, error in zip(user_ids, errors)
+            ]
+            await self.db.save_broadcast_results(
+                job_id, results, retry=True, retry_delay_minutes=self.retry_delay_minutes
+            )
+            delivered += sum(1 for error in errors if error is None)
+        return delivered
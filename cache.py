@@ -0,0 +1,80 @@
+"""LRU-кэш с необязательным TTL и счётчиками попаданий."""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш: при переполнении вытесняются давно не
+    использованные ключи, при заданном ttl (секунды) записи устаревают.
+    Не потокобезопасен — используется из event loop бота.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Значение без учёта в статистике и без обновления порядка"""
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def _lookup(self, key):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or self.ttl is None:
+            return entry
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.ttl is not None:
+            value = (value, time.monotonic() + (ttl if ttl is not None else self.ttl))
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            return default
+        del self._data[key]
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -1,24 +1,89 @@
 import os
+from enum import Enum
+from typing import Optional
 from telegram import Bot
 from dotenv import load_dotenv
 import logging
 
+from cache import LRUCache
+from ratelimit import RequestScheduler, Throttled
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+def channel_username(task) -> str:
+    """Username канала из ссылки задания на подписку"""
+    channel_link = task['extra_data'].get('channel_link', '')
+    return channel_link.split('/')[-1].replace('@', '')
+
+class SubscriptionStatus(Enum):
+    SUBSCRIBED = 'subscribed'
+    NOT_SUBSCRIBED = 'not_subscribed'
+    # Проверка не выполнена из-за лимитов Bot API — стоит повторить позже
+    THROTTLED = 'throttled'
+    ERROR = 'error'
+
 class SubscriptionChecker:
-    def __init__(self):
+    """Проверка подписки через второго бота.
+
+    Id канала по username почти никогда не меняется и кэшируется надолго.
+    Статус участника кэшируется коротко, чтобы повторные нажатия
+    «Проверить подписку» не ходили в Bot API; отрицательный результат
+    живёт ещё меньше — пользователь мог только что подписаться.
+    Запросы к API идут через общий RequestScheduler.
+    """
+
+    def __init__(self, chat_ttl: float = 86400, member_ttl: float = 60,
+                 negative_ttl: float = 5, size: int = 100_000,
+                 scheduler: Optional[RequestScheduler] = None):
         self.bot = Bot(token=os.getenv('CHECK_BOT_TOKEN'))
-        
-    async def check_subscription(self, channel_username: str, user_id: int) -> bool:
+        self.scheduler = scheduler or RequestScheduler(20)
+        self._chat_ids = LRUCache(10_000, ttl=chat_ttl)
+        self._members = LRUCache(size, ttl=member_ttl)
+        self.negative_ttl = negative_ttl
+
+    async def get_channel_id(self, channel_username: str) -> int:
+        key = channel_username.lower()
+        chat_id = self._chat_ids.get(key)
+        if chat_id is None:
+            chat = await self.scheduler.run(('chat', key), lambda: self.bot.get_chat(f"@{channel_username}"))
+            chat_id = chat.id
+            self._chat_ids.set(key, chat_id)
+        return chat_id
+
+    async def get_subscription_status(self, channel_username: str, user_id: int) -> SubscriptionStatus:
         try:
             # Получаем информацию о канале
-            chat = await self.bot.get_chat(f"@{channel_username}")
-            # Проверяем подписку
-            member = await self.bot.get_chat_member(chat_id=chat.id, user_id=user_id)
-            
-            return member.status in ['member', 'administrator', 'creator']
-            
+            chat_id = await self.get_channel_id(channel_username)
+
+            subscribed = self._members.get((chat_id, user_id))
+            if subscribed is None:
+                # Проверяем подписку; одновременные проверки одного пользователя объединяются
+                subscribed = await self.scheduler.run(
+                    ('member', chat_id, user_id), lambda: self._fetch_member(chat_id, user_id)
+                )
+            return SubscriptionStatus.SUBSCRIBED if subscribed else SubscriptionStatus.NOT_SUBSCRIBED
+
+        except Throttled:
+            logger.warning(f"Проверка подписки {user_id} на @{channel_username} отложена из-за лимитов")
+            return SubscriptionStatus.THROTTLED
         except Exception as e:
             logger.error(f"Ошибка при проверке подписки: {e}")
-            return False
\ No newline at end of file
+            return SubscriptionStatus.ERROR
+
+    async def _fetch_member(self, chat_id: int, user_id: int) -> bool:
+        member = await self.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+        subscribed = member.status in SUBSCRIBED_STATUSES
+        self._members.set((chat_id, user_id), subscribed, None if subscribed else self.negative_ttl)
+        return subscribed
+
+    async def check_subscription(self, channel_username: str, user_id: int) -> bool:
+        return await self.get_subscription_status(channel_username, user_id) == SubscriptionStatus.SUBSCRIBED
+
+    def cache_stats(self):
+        return {
+            'channel_ids': self._chat_ids.stats(),
+            'subscription_status': self._members.stats(),
+        }
@@ -0,0 +1,60 @@
+"""Битовые маски выполненных заданий по пользователям.
+
+Для каждого пользователя хранится одно целое число: бит N установлен,
+если задание с id N есть в completed_tasks. Id заданий выдаются подряд
+(AUTOINCREMENT) и не переиспользуются, поэтому id служит плотным
+индексом бита. Маски подгружаются из базы при первом обращении и
+вытесняются по LRU.
+"""
+from typing import Iterable, Optional
+
+from cache import LRUCache
+
+
+def mask_from_ids(task_ids: Iterable[int]) -> int:
+    mask = 0
+    for task_id in task_ids:
+        mask |= 1 << task_id
+    return mask
+
+
+class CompletedTasksIndex:
+    def __init__(self, max_users: int = 100_000):
+        self._masks = LRUCache(max_users)
+        # Незавершённые загрузки из базы: запись для пользователя во время
+        # загрузки делает её результат устаревшим
+        self._loading = {}
+
+    def get(self, user_id: int) -> Optional[int]:
+        return self._masks.get(user_id)
+
+    def begin_load(self, user_id: int) -> object:
+        token = object()
+        self._loading[user_id] = token
+        return token
+
+    def finish_load(self, user_id: int, token: object, task_ids: Iterable[int]) -> int:
+        mask = mask_from_ids(task_ids)
+        if self._loading.get(user_id) is token:
+            del self._loading[user_id]
+            self._masks.set(user_id, mask)
+        return mask
+
+    def cancel_load(self, user_id: int, token: object):
+        if self._loading.get(user_id) is token:
+            del self._loading[user_id]
+
+    def add(self, user_id: int, task_id: int):
+        self._loading.pop(user_id, None)
+        mask = self._masks.peek(user_id)
+        if mask is not None:
+            self._masks.set(user_id, mask | (1 << task_id))
+
+    def remove(self, user_id: int, task_id: int):
+        self._loading.pop(user_id, None)
+        mask = self._masks.peek(user_id)
+        if mask is not None:
+            self._masks.set(user_id, mask & ~(1 << task_id))
+
+    def stats(self):
+        return self._masks.stats()
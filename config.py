@@ -11,5 +11,121 @@ config = {
     "main_channel": "@LabradorFakt",  # Изменили формат
     "registration_link": "https://example.com/register",
     "admin_ids": [1373970155],  # Исправили ID
-    "auto_approve": False
+    "auto_approve": False,
+    # Скриншоты уходят админам по file_id; archive — дополнительно
+    # сохранять их в хранилище dir в фоне и искать похожие (расстояние
+    # Хэмминга перцептивных хешей не больше similar_max_distance, до 3)
+    "screenshots": {
+        "archive": True,
+        "dir": "screenshots",
+        "similar_max_distance": 3
+    },
+    # Очередь проверки скриншотов: сколько показывать за раз (не больше 10 —
+    # столько фото помещается в один альбом) и на сколько секунд админ
+    # закрепляет их за собой
+    "moderation": {
+        "page_size": 10,
+        "lease_seconds": 600
+    },
+    # Обслуживание скриншотов раз в interval_hours: проверенные уменьшаются
+    # до recompress_max_side пикселей и пересжимаются, одобренные старше
+    # pack_after_days дней упаковываются в архивы, отклонённые удаляются
+    # через reject_retention_days дней
+    "screenshot_retention": {
+        "interval_hours": 6,
+        "policy": {
+            "recompress_max_side": 1280,
+            "recompress_quality": 70,
+            "pack_after_days": 30,
+            "reject_retention_days": 14,
+            "batch_size": 500
+        }
+    },
+    "db_path": "bot.db",
+    # Сколько пользователей держать в кэше выполненных заданий
+    "completed_cache_size": 100000,
+    # Кэш балансов для клавиатуры меню: размер и время жизни записи в секундах
+    "balance_cache": {
+        "size": 100000,
+        "ttl": 300
+    },
+    # Проверка подписки: время жизни id канала, статуса подписчика и
+    # отрицательного ответа (секунды), размер кэша статусов
+    "subscription_cache": {
+        "chat_ttl": 86400,
+        "member_ttl": 60,
+        "negative_ttl": 5,
+        "size": 100000
+    },
+    # Запросы бота проверки к Bot API: в секунду, сколько разных проверок
+    # может ждать одновременно, сколько секунд ждать и повторов на RetryAfter
+    "subscription_scheduler": {
+        "rate": 20,
+        "max_pending": 500,
+        "max_wait": 10,
+        "max_retries": 2
+    },
+    # Повторная проверка подписок раз в interval_minutes: не больше
+    # hourly_budget запросов в час, выполнения не старше max_age_days дней
+    # перепроверяются раз в reverify_days дней. clawback — списывать награду
+    # у отписавшихся (иначе выполнение только помечается для админа)
+    "subscription_sweeper": {
+        "hourly_budget": 600,
+        "interval_minutes": 10,
+        "reverify_days": 7,
+        "max_age_days": 30,
+        "clawback": False
+    },
+    # Сессии пользователей в базе: как часто PTB отдаёт изменения (с),
+    # задержка пакетной записи (с) и через сколько секунд неактивности
+    # сессия выгружается из памяти
+    "sessions": {
+        "update_interval": 5,
+        "flush_delay": 1,
+        "idle_timeout": 1800
+    },
+    # Адрес Bot API; по умолчанию api.telegram.org
+    "api_url": os.getenv('TELEGRAM_API_URL'),
+    # Режим webhook (BOT_MODE=webhook) вместо polling: Telegram присылает
+    # обновления на url, запросы без secret_token отклоняются, не больше
+    # max_connections одновременных соединений от Telegram
+    "webhook": {
+        "enabled": os.getenv('BOT_MODE') == 'webhook',
+        "url": os.getenv('WEBHOOK_URL'),
+        "secret_token": os.getenv('WEBHOOK_SECRET'),
+        "listen": os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+        "port": int(os.getenv('WEBHOOK_PORT', '8443')),
+        "url_path": "telegram",
+        "max_connections": 40
+    },
+    # Профиль SQLite: режим журнала, PRAGMA и размер пула соединений для чтения
+    "storage": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "busy_timeout": 5000,
+        "read_pool_size": 4,
+        "commit_window_ms": 5,
+        "commit_max_batch": 256
+    },
+    # Журнал баланса: записи старше keep_days раз в interval_hours сворачиваются
+    "ledger_compaction": {
+        "interval_hours": 24,
+        "keep_days": 30
+    },
+    # Рассылка: сообщений в секунду на бота, параллельных отправок,
+    # повторов при временных ошибках и интервал обновления прогресса (с).
+    # Результаты пишутся в базу пачками по flush_size; получателям с ошибкой
+    # отправка повторяется по расписанию (первая пауза retry_delay_minutes,
+    # дальше вдвое дольше), всего не более max_attempts попыток
+    "broadcast": {
+        "rate": 25,
+        "concurrency": 20,
+        "max_retries": 3,
+        "progress_interval": 5,
+        "flush_size": 100,
+        "retry_delay_minutes": 10,
+        "max_attempts": 3
+    }
 }
\ No newline at end of file
@@ -1,177 +1,522 @@
-import sqlite3
-from typing import List, Dict, Optional
+import logging
+from typing import AsyncIterator, List, Dict, Optional
 import json
 
-class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('bot.db')
-        self.create_tables()
+import migrations
+from cache import LRUCache
+from completed_index import CompletedTasksIndex
+from screenshot_store import PHASH_BANDS, hamming_distance, phash_bands, phash_from_bands
+from storage import GroupCommitWriter, ReadPool, StorageProfile
+from task_catalog import TaskCatalog, task_from_row
 
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        # Создаем таблицу tasks если её нет
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            description TEXT NOT NULL,
-            reward REAL NOT NULL,
-            order_num INTEGER,
-            extra_data TEXT,
-            is_active BOOLEAN DEFAULT 1
-        )
-        ''')
+logger = logging.getLogger(__name__)
 
-        # Таблица пользователей
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            balance REAL DEFAULT 0,
-            current_task INTEGER DEFAULT NULL
+class Database:
+    def __init__(self, path: str = 'bot.db', profile: Optional[StorageProfile] = None,
+                 completed_cache_size: int = 100_000,
+                 balance_cache_size: int = 100_000, balance_cache_ttl: float = 300):
+        # Запись идёт через отдельный поток с групповой фиксацией,
+        # чтение — через пул соединений, чтобы запросы не блокировали
+        # event loop бота и не ждали друг друга
+        self.path = path
+        self.profile = profile or StorageProfile()
+        self._writer = GroupCommitWriter(
+            lambda: self.profile.connect(path),
+            window_ms=self.profile.commit_window_ms,
+            max_batch=self.profile.commit_max_batch,
         )
-        ''')
+        self.conn = self._writer.conn
+        self._writer.call_exclusive(lambda conn: self.create_tables())
+        self._readers = ReadPool(path, self.profile)
+        # Каталог заданий загружается при первом обращении
+        self._catalog: Optional[TaskCatalog] = None
+        self._catalog_version = 0
+        # Маски выполненных заданий активных пользователей
+        self._completed = CompletedTasksIndex(completed_cache_size)
+        # Балансы обновляются при записи, чтение меню не ходит в базу
+        self._balances = LRUCache(balance_cache_size, ttl=balance_cache_ttl)
+        self._balance_writes = 0
 
-        # Таблица выполненных заданий
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS completed_tasks (
-            user_id INTEGER,
-            task_id INTEGER,
-            status TEXT,
-            screenshot TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id),
-            FOREIGN KEY (task_id) REFERENCES tasks (id)
-        )
-        ''')
+    async def _write(self, func, *args):
+        """Выполняет func(conn, *args) в потоке записи, в общей транзакции пачки"""
+        return await self._writer.run(func, *args)
+
+    async def _read(self, func, *args):
+        """Выполняет func(conn, *args) на соединении из пула чтения"""
+        return await self._readers.run(func, *args)
+
+    async def _get_catalog(self) -> TaskCatalog:
+        catalog = self._catalog
+        if catalog is None:
+            version = self._catalog_version
+            catalog = TaskCatalog(await self._read(self._load_tasks))
+            # Если задания успели измениться во время загрузки, не кэшируем устаревшее
+            if version == self._catalog_version:
+                self._catalog = catalog
+        return catalog
+
+    def _load_tasks(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, type, description, reward, order_num, extra_data, is_active FROM tasks')
+        return [task_from_row(row) for row in cursor.fetchall()]
+
+    def _invalidate_catalog(self):
+        self._catalog = None
+        self._catalog_version += 1
 
-        self.conn.commit()
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Счётчики попаданий кэшей в памяти"""
+        return {
+            'balances': self._balances.stats(),
+            'completed_tasks': self._completed.stats(),
+        }
+
+    def create_tables(self):
+        """Применяет миграции схемы и запускает фоновую сборку индексов"""
+        indexes = migrations.apply_migrations(self.conn)
+        self._build_indexes_online(indexes)
+
+    def _build_indexes_online(self, indexes):
+        # Индексы ставятся в очередь потока БД по одному: следующий
+        # добавляется только после готовности предыдущего, так что
+        # запросы бота выполняются между сборками
+        if not indexes:
+            return
+        future = self._writer.submit_exclusive(migrations.build_index, indexes[0])
+        future.add_done_callback(lambda f: self._on_index_built(f, indexes[1:]))
+
+    def _on_index_built(self, future, rest):
+        if future.exception():
+            logger.error(f"Ошибка при построении индекса: {future.exception()}")
+        try:
+            self._build_indexes_online(rest)
+        except RuntimeError:
+            # База уже закрыта, оставшиеся индексы построятся при следующем старте
+            pass
 
     async def is_admin(self, user_id: int) -> bool:
-        cursor = self.conn.cursor()
+        return await self._read(self._is_admin, user_id)
+
+    def _is_admin(self, conn, user_id):
+        cursor = conn.cursor()
         cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
         return cursor.fetchone() is not None
 
     async def add_task(self, type: str, description: str, reward: float, extra_data: dict) -> int:
-        cursor = self.conn.cursor()
+        task_id = await self._write(self._add_task, type, description, reward, extra_data)
+        self._invalidate_catalog()
+        return task_id
+
+    def _add_task(self, conn, type, description, reward, extra_data):
+        cursor = conn.cursor()
         cursor.execute(
             'INSERT INTO tasks (type, description, reward, order_num, extra_data) VALUES (?, ?, ?, ?, ?)',
-            (type, description, reward, self.get_max_order() + 1, json.dumps(extra_data))
+            (type, description, reward, self._get_max_order(conn) + 1, json.dumps(extra_data))
         )
-        self.conn.commit()
         return cursor.lastrowid
 
     async def get_task(self, user_id: int) -> Optional[Dict]:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT t.* FROM tasks t
-            LEFT JOIN completed_tasks ct ON t.id = ct.task_id AND ct.user_id = ?
-            WHERE t.is_active = 1 AND ct.task_id IS NULL
-            ORDER BY t.order_num LIMIT 1
-        ''', (user_id,))
-        task = cursor.fetchone()
-        
-        if task:
-            return {
-                'id': task[0],
-                'type': task[1],
-                'description': task[2],
-                'reward': task[3],
-                'extra_data': json.loads(task[5]) if task[5] else {}
-            }
-        return None
-
-    def get_max_order(self) -> int:
-        cursor = self.conn.cursor()
+        tasks = await self.get_available_tasks(user_id)
+        return tasks[0] if tasks else None
+
+    def _get_max_order(self, conn):
+        cursor = conn.cursor()
         cursor.execute('SELECT MAX(order_num) FROM tasks')
         result = cursor.fetchone()[0]
         return result if result is not None else 0
 
-    async def save_screenshot(self, user_id: int, task_id: int, screenshot_path: str):
-        cursor = self.conn.cursor()
+    async def save_screenshot(self, user_id: int, task_id: int, screenshot_path: Optional[str] = None,
+                              file_id: Optional[str] = None) -> bool:
+        """Сохраняет скриншот на проверку; False — задание уже выполнено"""
+        saved = await self._write(self._save_screenshot, user_id, task_id, screenshot_path, file_id)
+        self._completed.add(user_id, task_id)
+        return saved
+
+    def _save_screenshot(self, conn, user_id, task_id, screenshot_path, file_id):
+        cursor = conn.cursor()
+        # Принятое выполнение не возвращается на проверку, иначе награду начислят повторно
+        cursor.execute(
+            '''INSERT INTO completed_tasks (user_id, task_id, screenshot, file_id, status) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, task_id) DO UPDATE SET
+                screenshot = excluded.screenshot,
+                file_id = excluded.file_id,
+                status = excluded.status,
+                timestamp = CURRENT_TIMESTAMP
+            WHERE completed_tasks.status NOT IN ('approved', 'completed', 'flagged')
+            ''',
+            (user_id, task_id, screenshot_path, file_id, 'pending')
+        )
+        return cursor.rowcount > 0
+
+    async def attach_screenshot_blob(self, user_id: int, task_id: int, digest: str, size: int,
+                                     phash: Optional[int] = None):
+        """Привязывает к выполнению файл из ScreenshotStore"""
+        await self._write(self._attach_screenshot_blob, user_id, task_id, digest, size, phash)
+
+    def _attach_screenshot_blob(self, conn, user_id, task_id, digest, size, phash):
+        cursor = conn.cursor()
+        bands = phash_bands(phash) if phash is not None else [None] * PHASH_BANDS
+        # Файл, уже упакованный или удалённый, снова лежит отдельно после повторной загрузки
+        cursor.execute(
+            '''INSERT INTO screenshot_blobs (digest, size, phash_b0, phash_b1, phash_b2, phash_b3)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (digest) DO UPDATE SET state = 'loose', segment = NULL, size = excluded.size, recompressed = 0
+            WHERE state != 'loose'
+            ''',
+            (digest, size, *bands)
+        )
+        cursor.execute(
+            'UPDATE completed_tasks SET screenshot = ? WHERE user_id = ? AND task_id = ?',
+            (digest, user_id, task_id)
+        )
+
+    async def find_similar_screenshots(self, user_id: int, task_id: int, digest: str,
+                                       phash: Optional[int] = None, max_distance: int = 3,
+                                       limit: int = 10) -> List[Dict]:
+        """Другие выполнения с тем же или похожим скриншотом.
+
+        Кандидаты ищутся по совпадению одной из полос перцептивного хеша,
+        поэтому при max_distance <= 3 ни одно похожее изображение не теряется.
+        """
+        return await self._read(
+            self._find_similar_screenshots, user_id, task_id, digest, phash, max_distance, limit
+        )
+
+    def _find_similar_screenshots(self, conn, user_id, task_id, digest, phash, max_distance, limit):
+        cursor = conn.cursor()
+        distances = {digest: 0}
+        if phash is not None:
+            cursor.execute(
+                '''SELECT digest, phash_b0, phash_b1, phash_b2, phash_b3 FROM screenshot_blobs
+                WHERE phash_b0 = ? OR phash_b1 = ? OR phash_b2 = ? OR phash_b3 = ?''',
+                phash_bands(phash)
+            )
+            for row in cursor.fetchall():
+                distance = hamming_distance(phash, phash_from_bands(row[1:]))
+                if distance <= max_distance:
+                    distances[row[0]] = min(distance, distances.get(row[0], distance))
+
+        placeholders = ', '.join('?' * len(distances))
         cursor.execute(
-            'INSERT INTO completed_tasks (user_id, task_id, screenshot, status) VALUES (?, ?, ?, ?)',
-            (user_id, task_id, screenshot_path, 'pending')
+            f'''SELECT user_id, task_id, screenshot FROM completed_tasks
+            WHERE screenshot IN ({placeholders}) AND NOT (user_id = ? AND task_id = ?)
+            LIMIT ?''',
+            (*distances, user_id, task_id, limit)
         )
-        self.conn.commit()
+        matches = [
+            {'user_id': row[0], 'task_id': row[1], 'distance': distances[row[2]]}
+            for row in cursor.fetchall()
+        ]
+        return sorted(matches, key=lambda match: match['distance'])
+
+    async def claim_pending_screenshots(self, admin_id: int, limit: int = 10, lease_seconds: int = 600,
+                                        after: Optional[list] = None, release: List[tuple] = ()) -> List[Dict]:
+        """Берёт в работу админу следующие скриншоты на проверку, старые первыми.
+
+        Взятые другим админом пропускаются, пока не истечёт аренда; свои
+        возвращаются снова с продлённой арендой. after — позиция
+        [timestamp, rowid] последнего скриншота прошлой страницы, тогда
+        берутся только более поздние. С пропущенных пар release аренда
+        снимается, чтобы их могли взять другие админы.
+        """
+        items = await self._write(self._claim_pending_screenshots, admin_id, limit, lease_seconds, after, release)
+        catalog = await self._get_catalog()
+        for item in items:
+            item['reward'] = catalog.reward(item['task_id'])
+        return items
 
-    async def update_balance(self, user_id: int, amount: float):
-        cursor = self.conn.cursor()
+    def _claim_pending_screenshots(self, conn, admin_id, limit, lease_seconds, after, release):
+        cursor = conn.cursor()
+        cursor.executemany(
+            '''UPDATE completed_tasks SET claimed_by = NULL, claim_expires_at = NULL
+            WHERE user_id = ? AND task_id = ? AND claimed_by = ? AND status = 'pending'
+            ''',
+            [(user_id, task_id, admin_id) for user_id, task_id in release]
+        )
+        after_timestamp, after_rowid = after or (None, None)
         cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, balance)
-            VALUES (?, COALESCE((SELECT balance + ? FROM users WHERE user_id = ?), ?))
-        ''', (user_id, amount, user_id, amount))
-        self.conn.commit()
+            UPDATE completed_tasks SET claimed_by = ?, claim_expires_at = datetime('now', ?)
+            WHERE rowid IN (
+                SELECT rowid FROM completed_tasks
+                WHERE status = 'pending'
+                AND (claimed_by IS NULL OR claimed_by = ? OR claim_expires_at < datetime('now'))
+                AND (? IS NULL OR (timestamp, rowid) > (?, ?))
+                ORDER BY timestamp, rowid
+                LIMIT ?
+            )
+            RETURNING user_id, task_id, file_id, timestamp, rowid
+        ''', (admin_id, f'+{int(lease_seconds)} seconds', admin_id,
+              after_timestamp, after_timestamp, after_rowid, limit))
+        items = [
+            {'user_id': row[0], 'task_id': row[1], 'file_id': row[2], 'timestamp': row[3], 'rowid': row[4]}
+            for row in cursor.fetchall()
+        ]
+        return sorted(items, key=lambda item: (item['timestamp'], item['rowid']))
+
+    async def count_pending_screenshots(self) -> int:
+        return await self._read(lambda conn: conn.execute(
+            "SELECT COUNT(*) FROM completed_tasks WHERE status = 'pending'"
+        ).fetchone()[0])
+
+    async def review_screenshots(self, admin_id: int, items: List[tuple], approve: bool) -> List[Dict]:
+        """Принимает или отклоняет пачку скриншотов одной транзакцией.
+
+        items — пары (user_id, task_id). Пропускаются уже проверенные и взятые
+        в работу другим админом. При одобрении награды начисляются через
+        журнал баланса в той же транзакции. Возвращает проверенные позиции
+        с наградой и новым балансом.
+        """
+        catalog = await self._get_catalog()
+        rewards = {task_id: catalog.reward(task_id) for _, task_id in items}
+        reviewed = await self._write(
+            self._review_screenshots, admin_id, items, 'approved' if approve else 'rejected', rewards
+        )
+        for item in reviewed:
+            if item['balance'] is not None:
+                self._remember_balance(item['user_id'], item['balance'])
+        return reviewed
+
+    def _review_screenshots(self, conn, admin_id, items, status, rewards):
+        cursor = conn.cursor()
+        reviewed = []
+        for user_id, task_id in items:
+            cursor.execute('''
+                UPDATE completed_tasks
+                SET status = ?, reviewed_at = CURRENT_TIMESTAMP, claimed_by = NULL, claim_expires_at = NULL
+                WHERE user_id = ? AND task_id = ? AND status = 'pending'
+                AND (claimed_by IS NULL OR claimed_by = ? OR claim_expires_at < datetime('now'))
+            ''', (status, user_id, task_id, admin_id))
+            if cursor.rowcount == 0:
+                continue
+            balance = None
+            if status == 'approved':
+                balance = self._update_balance(conn, user_id, rewards[task_id], f'task:{task_id}')
+            reviewed.append({
+                'user_id': user_id, 'task_id': task_id, 'reward': rewards[task_id], 'balance': balance
+            })
+        return reviewed
+
+    # Условия отбора файлов для обслуживания хранилища. Файл может быть общим
+    # для нескольких выполнений, поэтому решение принимается по всем ссылкам.
+    _BLOB_REFERENCED = 'EXISTS (SELECT 1 FROM completed_tasks c WHERE c.screenshot = b.digest)'
+    _BLOB_REVIEWED = (
+        "NOT EXISTS (SELECT 1 FROM completed_tasks c WHERE c.screenshot = b.digest "
+        "AND c.status NOT IN ('approved', 'rejected'))"
+    )
+
+    @staticmethod
+    def _blob_all_refs(status: str, blob: str = 'b') -> str:
+        return (
+            f"NOT EXISTS (SELECT 1 FROM completed_tasks c WHERE c.screenshot = {blob}.digest "
+            f"AND (c.status != '{status}' OR c.reviewed_at >= datetime('now', ?)))"
+        )
+
+    async def get_blobs_to_recompress(self, limit: int = 100) -> List[str]:
+        """Отдельные файлы, по всем выполнениям которых решение уже принято"""
+        return await self._read(lambda conn: [row[0] for row in conn.execute(f'''
+            SELECT b.digest FROM screenshot_blobs b
+            WHERE b.state = 'loose' AND b.recompressed = 0
+            AND {self._BLOB_REFERENCED} AND {self._BLOB_REVIEWED}
+            LIMIT ?
+        ''', (limit,))])
+
+    async def mark_blob_recompressed(self, digest: str, size: Optional[int]):
+        await self._write(lambda conn: conn.execute(
+            'UPDATE screenshot_blobs SET recompressed = 1, size = COALESCE(?, size) WHERE digest = ?',
+            (size, digest)
+        ))
+
+    async def get_blobs_to_pack(self, older_than_days: int, limit: int = 1000) -> List[str]:
+        """Одобренные больше older_than_days дней назад файлы, которые ещё лежат отдельно"""
+        return await self._read(lambda conn: [row[0] for row in conn.execute(f'''
+            SELECT b.digest FROM screenshot_blobs b
+            WHERE b.state = 'loose' AND {self._BLOB_REFERENCED} AND {self._blob_all_refs('approved')}
+            LIMIT ?
+        ''', (f'-{int(older_than_days)} days', limit))])
+
+    async def mark_blobs_packed(self, digests: List[str], segment: str, older_than_days: int) -> List[str]:
+        """Отмечает файлы упакованными; возвращает те, для которых условие ещё выполняется"""
+        return await self._write(
+            self._mark_blobs, digests, "state = 'packed', segment = ?", (segment,),
+            'approved', f'-{int(older_than_days)} days'
+        )
+
+    async def get_blobs_to_delete(self, older_than_days: int, limit: int = 1000) -> List[str]:
+        """Файлы, отклонённые по всем выполнениям больше older_than_days дней назад"""
+        return await self._read(lambda conn: [row[0] for row in conn.execute(f'''
+            SELECT b.digest FROM screenshot_blobs b
+            WHERE b.state = 'loose' AND {self._BLOB_REFERENCED} AND {self._blob_all_refs('rejected')}
+            LIMIT ?
+        ''', (f'-{int(older_than_days)} days', limit))])
+
+    async def mark_blobs_deleted(self, digests: List[str], older_than_days: int) -> List[str]:
+        # Строка файла остаётся: по хешу по-прежнему находятся повторные загрузки
+        return await self._write(
+            self._mark_blobs, digests, "state = 'deleted'", (),
+            'rejected', f'-{int(older_than_days)} days'
+        )
+
+    def _mark_blobs(self, conn, digests, assignments, params, status, cutoff):
+        # Условие проверяется повторно: пока шла работа с файлами, могла прийти новая ссылка
+        cursor = conn.cursor()
+        condition = self._blob_all_refs(status, 'screenshot_blobs')
+        marked = []
+        for digest in digests:
+            cursor.execute(
+                f"UPDATE screenshot_blobs SET {assignments} "
+                f"WHERE digest = ? AND state = 'loose' AND {condition} RETURNING digest",
+                (*params, digest, cutoff)
+            )
+            marked.extend(row[0] for row in cursor.fetchall())
+        return marked
+
+    async def update_balance(self, user_id: int, amount: float, reason: Optional[str] = None):
+        balance = await self._write(self._update_balance, user_id, amount, reason)
+        self._remember_balance(user_id, balance)
+
+    def _remember_balance(self, user_id: int, balance: float):
+        self._balance_writes += 1
+        self._balances.set(user_id, balance)
+
+    def _update_balance(self, conn, user_id, amount, reason=None):
+        # Запись в журнал и изменение баланса одной операцией без чтения строки
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO balance_ledger (user_id, amount, reason) VALUES (?, ?, ?)',
+            (user_id, amount, reason)
+        )
+        cursor.execute('''
+            INSERT INTO users (user_id, balance) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET balance = balance + excluded.balance
+            RETURNING balance
+        ''', (user_id, amount))
+        return float(cursor.fetchone()[0])
+
+    async def compact_ledger(self, keep_days: int = 30) -> int:
+        """Сворачивает старые записи журнала баланса в одну на пользователя"""
+        return await self._write(self._compact_ledger, keep_days)
+
+    def _compact_ledger(self, conn, keep_days):
+        cursor = conn.cursor()
+        cutoff = f'-{int(keep_days)} days'
+        last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM balance_ledger').fetchone()[0]
+        cursor.execute('''
+            INSERT INTO balance_ledger (user_id, amount, reason, created_at)
+            SELECT user_id, SUM(amount), 'compacted', MAX(created_at)
+            FROM balance_ledger
+            WHERE id <= ? AND created_at < datetime('now', ?)
+            GROUP BY user_id
+            HAVING COUNT(*) > 1
+        ''', (last_id, cutoff))
+        cursor.execute('''
+            DELETE FROM balance_ledger
+            WHERE id <= ? AND created_at < datetime('now', ?)
+            AND user_id IN (SELECT user_id FROM balance_ledger WHERE id > ?)
+        ''', (last_id, cutoff, last_id))
+        return cursor.rowcount
 
     async def get_all_users(self) -> List[int]:
-        cursor = self.conn.cursor()
+        return await self._read(self._get_all_users)
+
+    def _get_all_users(self, conn):
+        cursor = conn.cursor()
         cursor.execute('SELECT user_id FROM users')
         return [row[0] for row in cursor.fetchall()]
 
+    async def iter_user_ids(self, after_user_id: int = 0, batch_size: int = 1000,
+                            has_balance: bool = False, completed_task_id: Optional[int] = None,
+                            active_since: Optional[str] = None, reachable_only: bool = False) -> AsyncIterator[int]:
+        """Потоково перебирает user_id по возрастанию, страницами по первичному ключу.
+
+        Фильтры сегмента: has_balance — баланс больше нуля, completed_task_id —
+        задание есть в completed_tasks, active_since ('YYYY-MM-DD HH:MM:SS') —
+        выполнял задания не раньше этого времени, reachable_only — без
+        пользователей, заблокировавших бота.
+        """
+        where, params = self._user_segment(has_balance, completed_task_id, active_since, reachable_only)
+        while True:
+            page = await self._read(self._get_user_ids_page, where, params, after_user_id, batch_size)
+            for user_id in page:
+                yield user_id
+            if len(page) < batch_size:
+                return
+            after_user_id = page[-1]
+
+    async def count_users(self, has_balance: bool = False, completed_task_id: Optional[int] = None,
+                          active_since: Optional[str] = None, reachable_only: bool = False) -> int:
+        where, params = self._user_segment(has_balance, completed_task_id, active_since, reachable_only)
+        return await self._read(lambda conn: conn.execute(
+            f'SELECT COUNT(*) FROM users WHERE {where}', params
+        ).fetchone()[0])
+
+    @staticmethod
+    def _user_segment(has_balance=False, completed_task_id=None, active_since=None, reachable_only=False):
+        conditions = ['1 = 1']
+        params = []
+        if has_balance:
+            conditions.append('balance > 0')
+        if completed_task_id is not None:
+            conditions.append(
+                'EXISTS (SELECT 1 FROM completed_tasks ct WHERE ct.user_id = users.user_id AND ct.task_id = ?)'
+            )
+            params.append(completed_task_id)
+        if active_since is not None:
+            conditions.append(
+                'EXISTS (SELECT 1 FROM completed_tasks ct WHERE ct.user_id = users.user_id AND ct.timestamp >= ?)'
+            )
+            params.append(active_since)
+        if reachable_only:
+            conditions.append(
+                'NOT EXISTS (SELECT 1 FROM delivery_health h WHERE h.user_id = users.user_id AND h.blocked = 1)'
+            )
+        return ' AND '.join(conditions), tuple(params)
+
+    def _get_user_ids_page(self, conn, where, params, after_user_id, batch_size):
+        cursor = conn.cursor()
+        cursor.execute(
+            f'SELECT user_id FROM users WHERE user_id > ? AND {where} ORDER BY user_id LIMIT ?',
+            (after_user_id, *params, batch_size)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
     async def get_task_by_id(self, task_id: int) -> Optional[Dict]:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-        task = cursor.fetchone()
-        
-        if task:
-            return {
-                'id': task[0],
-                'type': task[1],
-                'description': task[2],
-                'reward': task[3],
-                'extra_data': json.loads(task[5]) if task[5] else {}
-            }
-        return None
+        return (await self._get_catalog()).get(task_id)
 
     async def get_task_reward(self, task_id: int) -> float:
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT reward FROM tasks WHERE id = ?', (task_id,))
-        result = cursor.fetchone()
-        return result[0] if result else 0.0
+        return (await self._get_catalog()).reward(task_id)
 
     async def get_all_tasks(self) -> List[Dict]:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT id, type, description, reward, extra_data
-            FROM tasks
-            WHERE is_active = 1
-            ORDER BY order_num
-        ''')
-        tasks = cursor.fetchall()
-        
-        return [{
-            'id': task[0],
-            'type': task[1],
-            'description': task[2],
-            'reward': task[3],
-            'extra_data': json.loads(task[4]) if task[4] else {}
-        } for task in tasks]
+        return list((await self._get_catalog()).active)
 
     async def get_available_tasks(self, user_id: int) -> List[Dict]:
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT t.* FROM tasks t
-            LEFT JOIN completed_tasks ct 
-            ON t.id = ct.task_id AND ct.user_id = ?
-            WHERE t.is_active = 1 
-            AND ct.task_id IS NULL
-            ORDER BY t.order_num
-        ''', (user_id,))
-        
-        tasks = cursor.fetchall()
-        return [{
-            'id': task[0],
-            'type': task[1],
-            'description': task[2],
-            'reward': task[3],
-            'extra_data': json.loads(task[5]) if task[5] else {}
-        } for task in tasks]
+        catalog = await self._get_catalog()
+        return catalog.available(await self._get_completed_mask(user_id))
+
+    async def get_next_available_task(self, user_id: int, after: Optional[tuple] = None) -> Optional[Dict]:
+        """Следующее доступное задание после позиции after (первое, если не задана)"""
+        catalog = await self._get_catalog()
+        return catalog.next_available(await self._get_completed_mask(user_id), after)
+
+    async def _get_completed_mask(self, user_id: int) -> int:
+        mask = self._completed.get(user_id)
+        if mask is None:
+            token = self._completed.begin_load(user_id)
+            try:
+                task_ids = await self._read(self._get_completed_task_ids, user_id)
+            except Exception:
+                self._completed.cancel_load(user_id, token)
+                raise
+            mask = self._completed.finish_load(user_id, token, task_ids)
+        return mask
+
+    def _get_completed_task_ids(self, conn, user_id):
+        cursor = conn.cursor()
+        cursor.execute('SELECT task_id FROM completed_tasks WHERE user_id = ?', (user_id,))
+        return [row[0] for row in cursor.fetchall()]
 
     async def debug_print_tasks(self):
         """Выводит все задания для отладки"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM tasks')
-        tasks = cursor.fetchall()
+        tasks = await self._read(lambda conn: conn.execute('SELECT * FROM tasks').fetchall())
         print("\nВсе задания в базе:")
         for task in tasks:
             print(f"ID: {task[0]}")
@@ -183,18 +528,141 @@ class Database:
             print(f"Активно: {task[6]}")
             print("---")
 
-    async def mark_task_completed(self, user_id: int, task_id: int):
-        """Отмечает задание как выполненное"""
-        cursor = self.conn.cursor()
+    async def mark_task_completed(self, user_id: int, task_id: int) -> bool:
+        """Отмечает задание как выполненное; False — выполнение уже есть"""
+        marked = await self._write(self._mark_task_completed, user_id, task_id)
+        self._completed.add(user_id, task_id)
+        return marked
+
+    async def complete_subscription_task(self, user_id: int, task_id: int) -> Optional[float]:
+        """Отмечает задание выполненным и начисляет награду одной транзакцией.
+
+        Награда начисляется, только если задание ещё не было выполнено, поэтому
+        повторное нажатие не даёт двойного начисления. Возвращает новый баланс
+        или None, если задание уже выполнено.
+        """
+        reward = (await self._get_catalog()).reward(task_id)
+        balance = await self._write(self._complete_subscription_task, user_id, task_id, reward)
+        if balance is not None:
+            self._completed.add(user_id, task_id)
+            self._remember_balance(user_id, balance)
+        return balance
+
+    def _complete_subscription_task(self, conn, user_id, task_id, reward):
+        cursor = conn.cursor()
         cursor.execute(
-            'INSERT INTO completed_tasks (user_id, task_id, status) VALUES (?, ?, ?)',
+            '''INSERT INTO completed_tasks (user_id, task_id, status) VALUES (?, ?, 'completed')
+            ON CONFLICT (user_id, task_id) DO NOTHING''',
+            (user_id, task_id)
+        )
+        if cursor.rowcount == 0:
+            return None
+        return self._update_balance(conn, user_id, reward, f'task:{task_id}')
+
+    async def get_subscriptions_to_verify(self, limit: int, reverify_days: int = 7,
+                                          max_age_days: int = 30) -> List[tuple]:
+        """Выполненные задания на подписку для повторной проверки, новые первыми.
+
+        Берутся выполнения не старше max_age_days дней, которые не проверялись
+        последние reverify_days дней. Возвращает пары (user_id, task_id).
+        """
+        task_ids = [task['id'] for task in (await self._get_catalog()).active if task['type'] == 'subscribe']
+        if not task_ids:
+            return []
+        return await self._read(self._get_subscriptions_to_verify, task_ids, limit, reverify_days, max_age_days)
+
+    def _get_subscriptions_to_verify(self, conn, task_ids, limit, reverify_days, max_age_days):
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(task_ids))
+        cursor.execute(f'''
+            SELECT user_id, task_id FROM completed_tasks
+            WHERE status = 'completed' AND task_id IN ({placeholders})
+            AND timestamp >= datetime('now', ?)
+            AND (last_verified_at IS NULL OR last_verified_at < datetime('now', ?))
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', (*task_ids, f'-{int(max_age_days)} days', f'-{int(reverify_days)} days', limit))
+        return cursor.fetchall()
+
+    async def save_subscription_checks(self, verified: List[tuple], unsubscribed: List[tuple],
+                                       clawback: bool = False) -> List[Dict]:
+        """Записывает результаты повторной проверки подписок одной транзакцией.
+
+        verified и unsubscribed — пары (user_id, task_id). Отписавшиеся
+        попадают в subscription_events. При clawback награда списывается
+        отрицательной записью в журнале баланса, а выполнение удаляется —
+        задание снова становится доступным; иначе выполнение помечается
+        'flagged'. Возвращает события по отписавшимся.
+        """
+        catalog = await self._get_catalog()
+        rewards = {task_id: catalog.reward(task_id) for _, task_id in unsubscribed}
+        events = await self._write(self._save_subscription_checks, verified, unsubscribed, clawback, rewards)
+        for event in events:
+            if clawback:
+                self._completed.remove(event['user_id'], event['task_id'])
+            if event['balance'] is not None:
+                self._remember_balance(event['user_id'], event['balance'])
+        return events
+
+    def _save_subscription_checks(self, conn, verified, unsubscribed, clawback, rewards):
+        cursor = conn.cursor()
+        cursor.executemany(
+            'UPDATE completed_tasks SET last_verified_at = CURRENT_TIMESTAMP WHERE user_id = ? AND task_id = ?',
+            verified
+        )
+        events = []
+        for user_id, task_id in unsubscribed:
+            # Выполнение могли изменить, пока шла проверка
+            if clawback:
+                cursor.execute(
+                    "DELETE FROM completed_tasks WHERE user_id = ? AND task_id = ? AND status = 'completed'",
+                    (user_id, task_id)
+                )
+            else:
+                cursor.execute(
+                    '''UPDATE completed_tasks SET status = 'flagged', last_verified_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND task_id = ? AND status = 'completed'
+                    ''',
+                    (user_id, task_id)
+                )
+            if cursor.rowcount == 0:
+                continue
+            amount = -rewards[task_id] if clawback else None
+            balance = self._update_balance(conn, user_id, amount, f'clawback:{task_id}') if clawback else None
+            events.append({
+                'user_id': user_id, 'task_id': task_id,
+                'event': 'clawback' if clawback else 'unsubscribed',
+                'amount': amount, 'balance': balance,
+            })
+        cursor.executemany(
+            'INSERT INTO subscription_events (user_id, task_id, event, amount) VALUES (?, ?, ?, ?)',
+            [(event['user_id'], event['task_id'], event['event'], event['amount']) for event in events]
+        )
+        return events
+
+    def _mark_task_completed(self, conn, user_id, task_id):
+        cursor = conn.cursor()
+        # Статус существующего выполнения (на проверке, принято, отмечено) не трогаем
+        cursor.execute(
+            '''INSERT INTO completed_tasks (user_id, task_id, status) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, task_id) DO NOTHING''',
             (user_id, task_id, 'completed')
         )
-        self.conn.commit()
+        return cursor.rowcount > 0
 
     async def get_balance(self, user_id: int) -> float:
         """Получает баланс пользователя"""
-        cursor = self.conn.cursor()
+        balance = self._balances.get(user_id)
+        if balance is None:
+            writes = self._balance_writes
+            balance = await self._read(self._get_balance, user_id)
+            # Запись во время чтения уже положила в кэш более новое значение
+            if writes == self._balance_writes:
+                self._balances.set(user_id, balance)
+        return balance
+
+    def _get_balance(self, conn, user_id):
+        cursor = conn.cursor()
         cursor.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
         return result[0] if result else 0.0
@@ -202,84 +670,284 @@ class Database:
     async def update_task(self, task_id: int, updates: dict) -> bool:
         """Оновлює задання за вказаним ID"""
         try:
-            cursor = self.conn.cursor()
-            update_fields = []
-            values = []
-            
-            if 'description' in updates:
-                update_fields.append('description = ?')
-                values.append(updates['description'])
-                
-            if 'reward' in updates:
-                update_fields.append('reward = ?')
-                values.append(float(updates['reward']))
-                
-            if 'order_num' in updates:
-                update_fields.append('order_num = ?')
-                values.append(updates['order_num'])
-                
-            if 'extra_data' in updates:
-                update_fields.append('extra_data = ?')
-                values.append(json.dumps(updates['extra_data']))
-            
-            if update_fields:
-                query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ?"
-                values.append(task_id)
-                cursor.execute(query, values)
-                self.conn.commit()
-                return True
-            return False
-            
+            updated = await self._write(self._update_task, task_id, updates)
+            self._invalidate_catalog()
+            return updated
+
         except Exception as e:
             logger.error(f"Ошибка при обновлении задания: {e}")
             return False
 
+    def _update_task(self, conn, task_id, updates):
+        cursor = conn.cursor()
+        update_fields = []
+        values = []
+
+        if 'description' in updates:
+            update_fields.append('description = ?')
+            values.append(updates['description'])
+
+        if 'reward' in updates:
+            update_fields.append('reward = ?')
+            values.append(float(updates['reward']))
+
+        if 'order_num' in updates:
+            update_fields.append('order_num = ?')
+            values.append(updates['order_num'])
+
+        if 'extra_data' in updates:
+            update_fields.append('extra_data = ?')
+            values.append(json.dumps(updates['extra_data']))
+
+        if update_fields:
+            query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ?"
+            values.append(task_id)
+            cursor.execute(query, values)
+            return True
+        return False
+
     async def delete_task(self, task_id: int) -> bool:
         """Видаляє задання з бази даних"""
         try:
-            cursor = self.conn.cursor()
-            # Видаляємо пов'язані записи
-            cursor.execute('DELETE FROM completed_tasks WHERE task_id = ?', (task_id,))
-            cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-            self.conn.commit()
+            await self._write(self._delete_task, task_id)
+            self._invalidate_catalog()
             return True
         except Exception as e:
             logger.error(f"Ошибка при удалении задания: {e}")
             return False
 
+    def _delete_task(self, conn, task_id):
+        cursor = conn.cursor()
+        # Видаляємо пов'язані записи
+        cursor.execute('DELETE FROM completed_tasks WHERE task_id = ?', (task_id,))
+        cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
     async def reorder_task(self, task_id: int, new_position: int) -> bool:
         """Змінює порядок завдань"""
         try:
-            cursor = self.conn.cursor()
-            # Отримуємо поточний порядок
-            cursor.execute('SELECT order_num FROM tasks WHERE id = ?', (task_id,))
-            current_order = cursor.fetchone()[0]
-            
-            if new_position > current_order:
-                # Зсуваємо завдання вгору
-                cursor.execute('''
-                    UPDATE tasks 
-                    SET order_num = order_num - 1 
-                    WHERE order_num > ? AND order_num <= ?
-                ''', (current_order, new_position))
-            else:
-                # Зсуваємо завдання вниз
-                cursor.execute('''
-                    UPDATE tasks 
-                    SET order_num = order_num + 1 
-                    WHERE order_num >= ? AND order_num < ?
-                ''', (new_position, current_order))
-            
-            # Встановлюємо нову позицію для завдання
-            cursor.execute('UPDATE tasks SET order_num = ? WHERE id = ?', 
-                         (new_position, task_id))
-            
-            self.conn.commit()
+            await self._write(self._reorder_task, task_id, new_position)
+            self._invalidate_catalog()
             return True
-            
+
         except Exception as e:
             logger.error(f"Ошибка при изменении порядка задания: {e}")
             return False
 
+    def _reorder_task(self, conn, task_id, new_position):
+        cursor = conn.cursor()
+        # Отримуємо поточний порядок
+        cursor.execute('SELECT order_num FROM tasks WHERE id = ?', (task_id,))
+        current_order = cursor.fetchone()[0]
+
+        if new_position > current_order:
+            # Зсуваємо завдання вгору
+            cursor.execute('''
+                UPDATE tasks
+                SET order_num = order_num - 1
+                WHERE order_num > ? AND order_num <= ?
+            ''', (current_order, new_position))
+        else:
+            # Зсуваємо завдання вниз
+            cursor.execute('''
+                UPDATE tasks
+                SET order_num = order_num + 1
+                WHERE order_num >= ? AND order_num < ?
+            ''', (new_position, current_order))
+
+        # Встановлюємо нову позицію для завдання
+        cursor.execute('UPDATE tasks SET order_num = ? WHERE id = ?',
+                     (new_position, task_id))
+
+    async def create_broadcast_job(self, kind: str, text: Optional[str], file_id: Optional[str], total: int,
+                                   admin_chat_id: int, progress_message_id: int,
+                                   segment: Optional[Dict] = None) -> int:
+        """Сохраняет рассылку, чтобы продолжить её после перезапуска"""
+        return await self._write(
+            self._create_broadcast_job, kind, text, file_id, total, admin_chat_id, progress_message_id, segment
+        )
+
+    def _create_broadcast_job(self, conn, kind, text, file_id, total, admin_chat_id, progress_message_id, segment):
+        cursor = conn.cursor()
+        # Заблокировавшим бота из сегмента не отправляем — учитываем пропуск
+        where, params = self._user_segment(**(segment or {}))
+        cursor.execute(f'''
+            UPDATE delivery_health SET skipped_sends = skipped_sends + 1
+            WHERE blocked = 1 AND user_id IN (SELECT user_id FROM users WHERE {where})
+        ''', params)
+        skipped = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO broadcast_jobs (kind, text, file_id, total, admin_chat_id, progress_message_id, segment, skipped)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (kind, text, file_id, total, admin_chat_id, progress_message_id, json.dumps(segment or {}), skipped))
+        return cursor.lastrowid
+
+    async def get_broadcast_job(self, job_id: int) -> Optional[Dict]:
+        jobs = await self._read(self._get_broadcast_jobs, 'id = ?', (job_id,))
+        return jobs[0] if jobs else None
+
+    async def get_running_broadcast_jobs(self) -> List[Dict]:
+        return await self._read(self._get_broadcast_jobs, "status = 'running'", ())
+
+    def _get_broadcast_jobs(self, conn, where, params):
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id, kind, text, file_id, last_user_id, total, success, failed,
+                   admin_chat_id, progress_message_id, segment, skipped
+            FROM broadcast_jobs WHERE {where} ORDER BY id
+        ''', params)
+        columns = [column[0] for column in cursor.description]
+        jobs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for job in jobs:
+            job['segment'] = json.loads(job['segment']) if job['segment'] else {}
+        return jobs
+
+    async def save_broadcast_results(self, job_id: int, results: List[tuple], last_user_id: Optional[int] = None,
+                                     retry: bool = False, retry_delay_minutes: int = 10):
+        """Пачкой записывает результаты отправки и контрольную точку рассылки.
+
+        results — кортежи (user_id, status, error), где status: 'sent',
+        'failed' (будет повтор), 'dead' (пользователь недоступен) или
+        'rejected' (Telegram отклонил само сообщение, повтора нет).
+        """
+        await self._write(self._save_broadcast_results, job_id, results, last_user_id, retry, retry_delay_minutes)
+
+    def _save_broadcast_results(self, conn, job_id, results, last_user_id, retry, retry_delay_minutes):
+        cursor = conn.cursor()
+        # Следующая попытка откладывается вдвое дольше после каждой неудачи
+        cursor.executemany('''
+            INSERT INTO broadcast_recipients (job_id, user_id, status, attempts, next_attempt_at, error)
+            VALUES (?, ?, ?, 1, datetime('now', printf('+%d minutes', ?)), ?)
+            ON CONFLICT (job_id, user_id) DO UPDATE SET
+                status = excluded.status,
+                attempts = attempts + 1,
+                next_attempt_at = datetime('now', printf('+%d minutes', ? * (1 << attempts))),
+                error = excluded.error
+        ''', [
+            (job_id, user_id, status, retry_delay_minutes, error, retry_delay_minutes)
+            for user_id, status, error in results
+        ])
+        self._record_delivery(conn, [(user_id, status) for user_id, status, _ in results])
+        sent = sum(1 for _, status, _ in results if status == 'sent')
+        # Повторная попытка не добавляет получателей, а переводит ошибку в успех
+        failed = -sent if retry else len(results) - sent
+        cursor.execute('''
+            UPDATE broadcast_jobs
+            SET success = success + ?, failed = failed + ?, last_user_id = COALESCE(?, last_user_id)
+            WHERE id = ?
+        ''', (sent, failed, last_user_id, job_id))
+
+    async def get_broadcast_recipients_after(self, job_id: int, user_id: int) -> set:
+        """Получатели с записанным результатом после контрольной точки"""
+        rows = await self._read(lambda conn: conn.execute(
+            'SELECT user_id FROM broadcast_recipients WHERE job_id = ? AND user_id > ?', (job_id, user_id)
+        ).fetchall())
+        return {row[0] for row in rows}
+
+    async def record_delivery(self, user_id: int, status: str):
+        """Обновляет состояние доставки после отправки: 'sent', 'failed' или 'dead'.
+
+        'rejected' — ошибка в самом сообщении, состояние пользователя не меняется.
+        """
+        await self._write(self._record_delivery, [(user_id, status)])
+
+    def _record_delivery(self, conn, results):
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO delivery_health (user_id, last_success_at) VALUES (?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                last_success_at = excluded.last_success_at,
+                consecutive_failures = 0,
+                blocked = 0,
+                blocked_at = NULL
+        ''', [(user_id,) for user_id, status in results if status == 'sent'])
+        cursor.executemany('''
+            INSERT INTO delivery_health (user_id, consecutive_failures) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET consecutive_failures = consecutive_failures + 1
+        ''', [(user_id,) for user_id, status in results if status == 'failed'])
+        # Бот заблокирован или чат удалён — дальше такому пользователю не пишем
+        cursor.executemany('''
+            INSERT INTO delivery_health (user_id, consecutive_failures, blocked, blocked_at)
+            VALUES (?, 1, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                consecutive_failures = consecutive_failures + 1,
+                blocked = 1,
+                blocked_at = COALESCE(blocked_at, excluded.blocked_at)
+        ''', [(user_id,) for user_id, status in results if status == 'dead'])
+
+    async def is_blocked(self, user_id: int) -> bool:
+        return await self._read(lambda conn: conn.execute(
+            'SELECT 1 FROM delivery_health WHERE user_id = ? AND blocked = 1', (user_id,)
+        ).fetchone() is not None)
+
+    async def record_skipped_send(self, user_id: int):
+        await self._write(lambda conn: conn.execute(
+            'UPDATE delivery_health SET skipped_sends = skipped_sends + 1 WHERE user_id = ?', (user_id,)
+        ))
+
+    async def mark_reachable(self, user_id: int):
+        """Пользователь снова написал боту — снимаем отметку о блокировке"""
+        await self._write(lambda conn: conn.execute(
+            'UPDATE delivery_health SET blocked = 0, blocked_at = NULL, consecutive_failures = 0 '
+            'WHERE user_id = ? AND blocked = 1', (user_id,)
+        ))
+
+    async def get_delivery_report(self) -> Dict:
+        return await self._read(self._get_delivery_report)
+
+    def _get_delivery_report(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(blocked), 0),
+                COALESCE(SUM(CASE WHEN blocked = 0 AND consecutive_failures > 0 THEN 1 ELSE 0 END), 0),
+                COALESCE(SUM(skipped_sends), 0)
+            FROM delivery_health
+        ''')
+        tracked, blocked, failing, skipped = cursor.fetchone()
+        return {'tracked': tracked, 'blocked': blocked, 'failing': failing, 'skipped_sends': skipped}
+
+    async def load_user_session(self, user_id: int) -> Optional[str]:
+        """Сохранённый user_data пользователя в JSON"""
+        row = await self._read(lambda conn: conn.execute(
+            'SELECT data FROM user_sessions WHERE user_id = ?', (user_id,)
+        ).fetchone())
+        return row[0] if row else None
+
+    async def save_user_sessions(self, sessions: Dict[int, Optional[str]]):
+        """Записывает сессии одной транзакцией; None удаляет сессию"""
+        await self._write(self._save_user_sessions, sessions)
+
+    def _save_user_sessions(self, conn, sessions):
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO user_sessions (user_id, data) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+        ''', [(user_id, data) for user_id, data in sessions.items() if data is not None])
+        cursor.executemany(
+            'DELETE FROM user_sessions WHERE user_id = ?',
+            [(user_id,) for user_id, data in sessions.items() if data is None]
+        )
+
+    async def finish_broadcast_job(self, job_id: int):
+        await self._write(lambda conn: conn.execute(
+            "UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,)
+        ))
+
+    async def get_due_broadcast_retries(self, max_attempts: int, limit: int = 1000) -> List[tuple]:
+        """Получатели с ошибкой, для которых подошло время повтора: (job_id, user_id)"""
+        return await self._read(self._get_due_broadcast_retries, max_attempts, limit)
+
+    def _get_due_broadcast_retries(self, conn, max_attempts, limit):
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT job_id, user_id FROM broadcast_recipients
+            WHERE status = 'failed' AND next_attempt_at <= datetime('now') AND attempts < ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (max_attempts, limit))
+        return cursor.fetchall()
+
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self._readers.close()
+        self._writer.close()
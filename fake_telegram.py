@@ -0,0 +1,198 @@
+"""Поддельный Telegram для локальной проверки режима webhook.
+
+Отвечает на запросы бота к Bot API (getMe, setWebhook, sendMessage и т.д.)
+и, когда бот зарегистрирует webhook, отправляет на него обновления так же,
+как это делает Telegram: POST с JSON и заголовком секрета.
+
+Запуск:
+    python fake_telegram.py --port 8081 --updates 200
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:test BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8443/telegram WEBHOOK_SECRET=secret python main.py
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'test_bot'}
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.webhook = None
+        self.webhook_set = threading.Event()
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def message(self, chat_id, text=None) -> dict:
+        return {
+            'message_id': self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+            'text': text or '',
+        }
+
+    def handle(self, method: str, params: dict):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook = params
+            self.webhook_set.set()
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': (self.webhook or {}).get('url', ''), 'has_custom_certificate': False,
+                    'pending_update_count': 0}
+        if method == 'getUpdates':
+            return []
+        if method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            return self.message(params.get('chat_id', 0), params.get('text'))
+        return True
+
+
+def make_handler(telegram: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            params = self._parse(body)
+            method = self.path.rstrip('/').split('/')[-1]
+            result = telegram.handle(method, params)
+            data = json.dumps({'ok': True, 'result': result}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST
+
+        def _parse(self, body: bytes) -> dict:
+            if not body:
+                return {}
+            if 'json' in self.headers.get('Content-Type', ''):
+                return json.loads(body)
+            params = {}
+            for key, values in parse_qs(body.decode()).items():
+                try:
+                    params[key] = json.loads(values[0])
+                except ValueError:
+                    params[key] = values[0]
+            return params
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    chat = {'id': user_id, 'type': 'private'}
+    if update_id % 2:
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user,
+                'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            },
+        }
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id), 'from': user, 'chat_instance': str(user_id), 'data': 'understand',
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': BOT_USER,
+                        'text': '👋'},
+        },
+    }
+
+
+def post_update(url: str, secret, update: dict) -> int:
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', type=int, default=100)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--first-user', type=int, default=1_000_000)
+    parser.add_argument('--allowed-updates', default='callback_query,message',
+                        help='ожидаемые allowed_updates в setWebhook')
+    args = parser.parse_args()
+
+    telegram = FakeTelegram()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(telegram))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Bot API слушает на http://127.0.0.1:{args.port}, ждём setWebhook...")
+    telegram.webhook_set.wait()
+
+    failures = []
+    url = telegram.webhook['url']
+    secret = telegram.webhook.get('secret_token')
+    allowed_updates = telegram.webhook.get('allowed_updates')
+    print(f"Webhook: {url}, allowed_updates: {allowed_updates}")
+    if sorted(allowed_updates or []) != sorted(args.allowed_updates.split(',')):
+        failures.append(f"allowed_updates {allowed_updates}, ожидалось {args.allowed_updates}")
+    if not secret:
+        failures.append("webhook зарегистрирован без secret_token")
+    time.sleep(0.5)
+
+    # Запрос с неверным секретом сервер бота должен отклонить
+    status = post_update(url, 'wrong-secret', make_update(0, args.first_user))
+    print(f"Неверный секрет: HTTP {status}")
+    if status != 403:
+        failures.append(f"запрос с неверным секретом получил HTTP {status}, ожидался 403")
+
+    latencies = []
+
+    def send(update_id):
+        started = time.perf_counter()
+        status = post_update(url, secret, make_update(update_id, args.first_user + update_id % args.users))
+        latencies.append(time.perf_counter() - started)
+        return status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = list(pool.map(send, range(1, args.updates + 1)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(1 for status in statuses if status == 200)
+    print(
+        f"Отправлено {args.updates} обновлений за {elapsed:.2f} с, успешно {ok}, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} мс"
+    )
+    if ok != args.updates:
+        failures.append(f"успешно принято {ok} обновлений из {args.updates}")
+    time.sleep(1)
+    print(f"Вызовы Bot API: {telegram.calls}")
+    server.shutdown()
+    if failures:
+        raise SystemExit("ОШИБКА: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
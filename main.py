@@ -1,12 +1,22 @@
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, InputMediaPhoto
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+from telegram.error import TelegramError
 from dotenv import load_dotenv
 import logging
 from database import Database
+from storage import StorageProfile
 from config import config
 import asyncio
-from check_bot import SubscriptionChecker
+from check_bot import SubscriptionChecker, SubscriptionStatus, channel_username
+from ratelimit import RequestScheduler
+from broadcast import BroadcastEngine, BroadcastJob, BroadcastMessage, BroadcastStats, delivery_status
+from screenshot_store import ScreenshotStore, perceptual_hash
+from screenshot_retention import ScreenshotRetention
+from subscription_sweeper import SubscriptionSweeper
+from persistence import SQLitePersistence
+from task_cards import render_task_card, cache_stats as task_card_stats
+from task_catalog import order_key
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -18,8 +28,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = Database()
-subscription_checker = SubscriptionChecker()
+db = Database(
+    config['db_path'],
+    StorageProfile(**config['storage']),
+    completed_cache_size=config['completed_cache_size'],
+    balance_cache_size=config['balance_cache']['size'],
+    balance_cache_ttl=config['balance_cache']['ttl']
+)
+subscription_checker = SubscriptionChecker(
+    scheduler=RequestScheduler(**config['subscription_scheduler']),
+    **config['subscription_cache']
+)
+screenshot_store = ScreenshotStore(config['screenshots']['dir'])
+subscription_sweeper = SubscriptionSweeper(db, subscription_checker, **config['subscription_sweeper'])
+persistence = SQLitePersistence(db, **config['sessions'])
+# Создается в post_init, когда известен бот приложения
+broadcast_engine = None
+# Рассылки и периодические задачи. Application.stop() ждёт свои задачи до
+# конца, а рассылка может идти час, поэтому они запускаются отдельно и
+# отменяются в post_stop
+background_tasks = set()
 
 # Состояния пользователя
 class States:
@@ -57,6 +85,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
         logger.info(f"Запущена команда /start пользователем {user_id}")
+
+        # Пользователь снова пишет боту — значит, сообщения ему доходят
+        await db.mark_reachable(user_id)
         
         # Добавляем отладочное логирование
         logger.info(f"Admin IDs: {config['admin_ids']}")
@@ -113,66 +144,20 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
-        tasks = await db.get_available_tasks(user_id)
+        # Показываем первое доступное задание
+        task = await db.get_next_available_task(user_id)
         
-        if not tasks:
+        if not task:
             await update.message.reply_text(
                 "На данный момент нет доступных заданий 😔\n"
                 "Попробуйте проверить позже!"
             )
             return
 
-        # Сохраняем задания в контексте
-        context.user_data['available_tasks'] = tasks
-        context.user_data['task_index'] = 0
-
-        # Показываем первое доступное задание
-        task = tasks[0]
-        
-        # Добавляем проверку ссылок
-        if task['type'] == 'subscribe':
-            channel_link = task['extra_data'].get('channel_link', '')
-            if not channel_link.startswith('https://'):
-                channel_link = f"https://t.me/{channel_link.lstrip('@')}"
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("👉 Перейти в канал", url=channel_link)],
-                [InlineKeyboardButton("✅ Проверить подписку", callback_data=f"check_sub_{task['id']}")],
-                [InlineKeyboardButton("⏩ Следующее задание", callback_data="next_task")]
-            ])
-            
-            message_text = (
-                f"📋 Задание #{task['id']}\n\n"
-                f"Тип: Подписка на канал\n"
-                f"💎 Награда: {task['reward']} ₽\n\n"
-                f"📝 Описание:\n{task['description']}\n\n"
-                f"✅ Для выполнения задания:\n"
-                f"1. Перейдите по ссылке\n"
-                f"2. Подпишитесь на канал\n"
-                f"3. Нажмите кнопку проверки"
-            )
-            
-        elif task['type'] == 'register':
-            reg_link = task['extra_data'].get('reg_link', '')
-            if not reg_link.startswith(('http://', 'https://')):
-                reg_link = f"https://{reg_link}"
-                
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("👉 Перейти к регистрации", url=reg_link)],
-                [InlineKeyboardButton("📸 Отправить скриншот", callback_data=f"send_screenshot_{task['id']}")]
-            ])
-            
-            message_text = (
-                f"📋 Задание #{task['id']}\n\n"
-                f"Тип: Регистрация на сайте\n"
-                f"💎 Награда: {task['reward']} ₽\n\n"
-                f"📝 Описание:\n{task['description']}\n\n"
-                f"✅ Для выполнения задания:\n"
-                f"1. Перейдите по ссылке\n"
-                f"2. Зарегистрируйтесь на сайте\n"
-                f"3. Отправьте скриншот"
-            )
+        # В сессии храним только позицию показанного задания — с неё продолжается листание
+        context.user_data['task_cursor'] = order_key(task)
 
+        message_text, keyboard = render_task_card(task)
         await update.message.reply_text(
             text=message_text,
             reply_markup=keyboard
@@ -194,8 +179,10 @@ async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton("Добавить задание", callback_data="add_task")],
                 [InlineKeyboardButton("Список заданий", callback_data="list_tasks")],
+                [InlineKeyboardButton("🗂 Очередь проверки", callback_data="moderation_queue")],
                 [InlineKeyboardButton("📝 Редактировать задания", callback_data="edit_tasks")],
                 [InlineKeyboardButton("Сделать рассылку", callback_data="broadcast")],
+                [InlineKeyboardButton("📊 Доставка", callback_data="delivery_report")],
                 [InlineKeyboardButton("👤 Режим пользователя", callback_data="user_mode")]
             ])
             
@@ -207,7 +194,9 @@ async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton("Добавить задание", callback_data="add_task")],
                 [InlineKeyboardButton("Список заданий", callback_data="list_tasks")],
+                [InlineKeyboardButton("🗂 Очередь проверки", callback_data="moderation_queue")],
                 [InlineKeyboardButton("Сделать рассылку", callback_data="broadcast")],
+                [InlineKeyboardButton("📊 Доставка", callback_data="delivery_report")],
                 [InlineKeyboardButton("👤 Режим пользователя", callback_data="user_mode")]
             ])
             
@@ -240,6 +229,21 @@ async def add_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Ошибка в add_task_start: {e}", exc_info=True)
 
+async def notify_user(bot, user_id: int, text: str, **kwargs) -> bool:
+    """Отправляет уведомление пользователю, пропуская заблокировавших бота"""
+    if await db.is_blocked(user_id):
+        await db.record_skipped_send(user_id)
+        logger.info(f"Пользователь {user_id} заблокировал бота, уведомление пропущено")
+        return False
+    try:
+        await bot.send_message(user_id, text, **kwargs)
+        error = None
+    except TelegramError as e:
+        error = e
+        logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+    await db.record_delivery(user_id, delivery_status(error))
+    return error is None
+
 # Обработчик скриншотов
 async def handle_admin_task_response(update: Update, context: ContextTypes.DEFAULT_TYPE, approve: bool):
     try:
@@ -248,26 +252,132 @@ async def handle_admin_task_response(update: Update, context: ContextTypes.DEFAU
         user_id = int(data[1])
         task_id = int(data[2])
         
-        if approve:
-            reward = await db.get_task_reward(task_id)
-            await db.update_balance(user_id, reward)
-            
-            # Обновляем клавиатуру с новым балансом
-            new_keyboard = await get_main_keyboard_with_balance(user_id)
-            await context.bot.send_message(
-                user_id, 
-                "✅ Ваше задание одобрено! Баланс обновлен", 
-                reply_markup=new_keyboard
-            )
-        else:
-            await context.bot.send_message(user_id, "❌ Ваше задание отклонено")
-            
+        # Статус меняется только у непроверенного скриншота — повторное нажатие
+        # или второй админ ничего не начислят
+        reviewed = await db.review_screenshots(query.from_user.id, [(user_id, task_id)], approve)
+        if not reviewed:
+            await query.answer("Скриншот уже проверен", show_alert=True)
+            await query.message.delete()
+            return
+
+        await notify_review_results(context.bot, reviewed, approve)
+
         await query.answer()
         await query.message.delete()
         
     except Exception as e:
         logger.error(f"Ошибка в handle_admin_task_response: {e}", exc_info=True)
 
+async def show_moderation_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очередь проверки с начала (moderation_queue) или следующая страница (moderation_next)"""
+    try:
+        query = update.callback_query
+        await query.answer()
+        after, release = None, []
+        if query.data == 'moderation_next':
+            # Непроверенные позиции текущей страницы отдаём другим админам
+            after = context.user_data.get('moderation_cursor')
+            release = [tuple(item) for item in context.user_data.get('moderation_items', [])]
+        await send_moderation_page(context, query.from_user.id, after, release)
+
+    except Exception as e:
+        logger.error(f"Ошибка в show_moderation_queue: {e}", exc_info=True)
+
+async def send_moderation_page(context: ContextTypes.DEFAULT_TYPE, admin_id: int,
+                               after: list = None, release: list = ()):
+    """Берёт в работу страницу очереди: альбом скриншотов и кнопки решений"""
+    page_size, lease_seconds = config['moderation']['page_size'], config['moderation']['lease_seconds']
+    items = await db.claim_pending_screenshots(admin_id, page_size, lease_seconds, after, release)
+    if not items and after is not None:
+        # Дошли до конца очереди — начинаем сначала
+        items = await db.claim_pending_screenshots(admin_id, page_size, lease_seconds)
+    context.user_data['moderation_items'] = [(item['user_id'], item['task_id']) for item in items]
+    if not items:
+        context.user_data.pop('moderation_cursor', None)
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_admin")]
+        ])
+        await context.bot.send_message(admin_id, "✅ Очередь проверки пуста", reply_markup=keyboard)
+        return
+    context.user_data['moderation_cursor'] = [items[-1]['timestamp'], items[-1]['rowid']]
+
+    # Все скриншоты страницы одним запросом по file_id
+    media = [
+        InputMediaPhoto(item['file_id'], caption=f"{number}. Пользователь {item['user_id']}, задание #{item['task_id']}")
+        for number, item in enumerate(items, 1) if item['file_id']
+    ]
+    if len(media) == 1:
+        await context.bot.send_photo(admin_id, media[0].media, caption=media[0].caption)
+    elif media:
+        await context.bot.send_media_group(admin_id, media)
+
+    pending = await db.count_pending_screenshots()
+    await context.bot.send_message(
+        admin_id,
+        format_moderation_page(items, pending),
+        reply_markup=moderation_keyboard(context.user_data['moderation_items'])
+    )
+
+def format_moderation_page(items: list, pending: int) -> str:
+    text = f"🗂 На проверке: {pending}\n\n"
+    for number, item in enumerate(items, 1):
+        text += f"{number}. Пользователь {item['user_id']}, задание #{item['task_id']}, награда {item['reward']} ₽\n"
+    return text
+
+def moderation_keyboard(items: list) -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton(f"✅ {user_id}/#{task_id}", callback_data=f"mq_approve_{user_id}_{task_id}"),
+            InlineKeyboardButton(f"❌ {user_id}/#{task_id}", callback_data=f"mq_reject_{user_id}_{task_id}")
+        ]
+        for user_id, task_id in items
+    ]
+    keyboard.append([
+        InlineKeyboardButton("✅ Принять все", callback_data="mq_approve_all"),
+        InlineKeyboardButton("❌ Отклонить все", callback_data="mq_reject_all")
+    ])
+    keyboard.append([InlineKeyboardButton("⏩ Следующие", callback_data="moderation_next")])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_admin")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def handle_moderation_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Решение по одному скриншоту (mq_approve_<user>_<task>) или по всей странице (mq_approve_all)"""
+    try:
+        query = update.callback_query
+        _, action, *target = query.data.split('_')
+        approve = action == 'approve'
+        # После перезапуска пары приходят из JSON-сессии списками
+        page = [tuple(item) for item in context.user_data.get('moderation_items', [])]
+        items = page if target == ['all'] else [(int(target[0]), int(target[1]))]
+
+        reviewed = await db.review_screenshots(query.from_user.id, items, approve)
+        await query.answer(f"{'Принято' if approve else 'Отклонено'}: {len(reviewed)}")
+        context.application.create_task(notify_review_results(context.bot, reviewed, approve), update=update)
+
+        # Убираем обработанные позиции; после проверки всей страницы показываем следующую
+        remaining = [item for item in page if item not in items]
+        context.user_data['moderation_items'] = remaining
+        if remaining:
+            await query.message.edit_reply_markup(reply_markup=moderation_keyboard(remaining))
+        else:
+            await query.message.edit_reply_markup(reply_markup=None)
+            await send_moderation_page(context, query.from_user.id, context.user_data.get('moderation_cursor'))
+
+    except Exception as e:
+        logger.error(f"Ошибка в handle_moderation_action: {e}", exc_info=True)
+
+async def notify_review_results(bot, reviewed: list, approve: bool):
+    async def notify(item):
+        if approve:
+            await notify_user(
+                bot, item['user_id'], "✅ Ваше задание одобрено! Баланс обновлен",
+                reply_markup=await get_main_keyboard_with_balance(item['user_id'])
+            )
+        else:
+            await notify_user(bot, item['user_id'], "❌ Ваше задание отклонено")
+
+    await asyncio.gather(*(notify(item) for item in reviewed))
+
 async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         query = update.callback_query
@@ -280,20 +390,21 @@ async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.answer("Задание не найдено!", show_alert=True)
             return
             
-        # Получаем юзернейм канала из ссылки
-        channel_link = task['extra_data'].get('channel_link', '')
-        channel_username = channel_link.split('/')[-1].replace('@', '')
-        
         # Проверяем подписку через второго бота
-        is_subscribed = await subscription_checker.check_subscription(channel_username, user_id)
+        status = await subscription_checker.get_subscription_status(channel_username(task), user_id)
+        if status == SubscriptionStatus.THROTTLED:
+            await query.answer("⏳ Сейчас много проверок, попробуйте через минуту", show_alert=True)
+            return
+        if status == SubscriptionStatus.ERROR:
+            await query.answer("Не удалось проверить подписку, попробуйте позже", show_alert=True)
+            return
         
-        if (is_subscribed):
-            # Начисляем награду
+        if status == SubscriptionStatus.SUBSCRIBED:
+            # Отмечаем задание и начисляем награду, если оно ещё не выполнено
             reward = task['reward']
-            await db.update_balance(user_id, reward)
-            
-            # Отмечаем задание как выполненное
-            await db.mark_task_completed(user_id, task_id)
+            if await db.complete_subscription_task(user_id, task_id) is None:
+                await query.answer("Задание уже выполнено", show_alert=True)
+                return
             
             # Обновляем клавиатуру с новым балансом
             new_keyboard = await get_main_keyboard_with_balance(user_id)
@@ -323,45 +434,75 @@ async def handle_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if context.user_data.get('state') != States.WAITING_SCREENSHOT:
             return
 
-        # Создаем директорию если её нет
-        os.makedirs("screenshots", exist_ok=True)
-
-        # Сохраняем скриншот
         photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
         task_id = context.user_data.get('current_task_id')
-        file_path = f"screenshots/{user_id}_{task_id}.jpg"
-        
-        # Используем download_to_drive вместо download
-        await file.download_to_drive(file_path)
-        
-        # Сохраняем в базу
-        await db.save_screenshot(user_id, task_id, file_path)
 
-        # Отправляем на проверку админам
-        for admin_id in config['admin_ids']:
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Принять", callback_data=f"approve_{user_id}_{task_id}"),
-                    InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{user_id}_{task_id}")
-                ]
-            ])
-            
-            with open(file_path, 'rb') as photo:
-                await context.bot.send_photo(
-                    chat_id=admin_id,
-                    photo=photo,
-                    caption=f"📝 Новый скриншот\nПользователь: {user_id}\nЗадание #{task_id}\nНаграда: {context.user_data['current_task_reward']} ₽",
-                    reply_markup=keyboard
-                )
+        # Сохраняем в базу file_id — файл остаётся на серверах Telegram
+        if not await db.save_screenshot(user_id, task_id, file_id=photo.file_id):
+            context.user_data['state'] = States.NORMAL
+            await update.message.reply_text("✅ Это задание уже выполнено и оплачено.")
+            return
 
+        # Пользователь получает ответ сразу, отправка админам и архив идут в фоне
         await update.message.reply_text("✅ Скриншот отправлен на проверку! Ожидайте подтверждения.")
         context.user_data['state'] = States.NORMAL
 
+        keyboard = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("✅ Принять", callback_data=f"approve_{user_id}_{task_id}"),
+                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{user_id}_{task_id}")
+            ]
+        ])
+        caption = f"📝 Новый скриншот\nПользователь: {user_id}\nЗадание #{task_id}\nНаграда: {context.user_data['current_task_reward']} ₽"
+        context.application.create_task(
+            review_screenshot(context.bot, user_id, task_id, photo.file_id, caption, keyboard), update=update
+        )
+
     except Exception as e:
         logger.error(f"Ошибка в handle_screenshot: {e}", exc_info=True)
         await update.message.reply_text("❌ Произошла ошибка при обработке скриншота")
 
+async def send_screenshot_to_admins(bot, file_id: str, caption: str, keyboard: InlineKeyboardMarkup):
+    """Отправляет скриншот всем админам одновременно по file_id, без повторной загрузки"""
+    results = await asyncio.gather(*(
+        bot.send_photo(chat_id=admin_id, photo=file_id, caption=caption, reply_markup=keyboard)
+        for admin_id in config['admin_ids']
+    ), return_exceptions=True)
+    for admin_id, result in zip(config['admin_ids'], results):
+        if isinstance(result, Exception):
+            logger.error(f"Не удалось отправить скриншот админу {admin_id}: {result}")
+
+async def review_screenshot(bot, user_id: int, task_id: int, file_id: str, caption: str,
+                            keyboard: InlineKeyboardMarkup):
+    """Архивирует скриншот и отправляет его админам с пометкой о похожих скриншотах"""
+    if config['screenshots']['archive']:
+        similar = await archive_screenshot(bot, user_id, task_id, file_id)
+        if similar:
+            caption += "\n\n⚠️ Похожий скриншот уже присылали:\n" + "\n".join(
+                f"• пользователь {match['user_id']}, задание #{match['task_id']}"
+                + (" (точная копия)" if match['distance'] == 0 else "")
+                for match in similar
+            )
+    await send_screenshot_to_admins(bot, file_id, caption, keyboard)
+
+async def archive_screenshot(bot, user_id: int, task_id: int, file_id: str) -> list:
+    """Сохраняет скриншот в хранилище; возвращает другие выполнения с таким же скриншотом"""
+    try:
+        file = await bot.get_file(file_id)
+        data = bytes(await file.download_as_bytearray())
+        phash = await asyncio.to_thread(perceptual_hash, data)
+        # Под блокировкой обслуживание не уберёт файл между put и attach: put
+        # кладёт файл заново, даже если блоб раньше был упакован или удалён
+        async with screenshot_store.lock:
+            digest = await asyncio.to_thread(screenshot_store.put, data)
+            await db.attach_screenshot_blob(user_id, task_id, digest, len(data), phash)
+        return await db.find_similar_screenshots(
+            user_id, task_id, digest, phash, config['screenshots']['similar_max_distance']
+        )
+    except Exception as e:
+        logger.error(f"Ошибка архивации скриншота {user_id}_{task_id}: {e}", exc_info=True)
+        return []
+
 # Змінюємо функцію start_broadcast
 async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -390,19 +531,18 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Змінюємо функцію handle_broadcast_message
 async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        if context.user_data.get('state') != 'waiting_broadcast':
-            return
+    if context.user_data.get('state') != 'waiting_broadcast':
+        return
+    await send_broadcast(update, context)
+    # Сообщение ушло в рассылку — остальным обработчикам его не отдаём
+    raise ApplicationHandlerStop
 
+async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
         message = update.message
-        users = await db.get_all_users()
-        
-        # Статистика розсилки
-        total_users = len(users)
-        success = 0
-        failed = 0
-        failed_users = []  # Список користувачів, яким не вдалося відправити
-        
+        total_users = await db.count_users(reachable_only=True)
+        broadcast_message = BroadcastMessage.from_message(message)
+
         # Прогрес розсилки
         progress_msg = await message.reply_text(
             "📤 Начинаем рассылку...\n"
@@ -411,96 +551,136 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
             "Ошибок доставки: 0"
         )
 
-        for i, user_id in enumerate(users, 1):
-            try:
-                if message.photo:
-                    # Відправка фото з підписом
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=message.photo[-1].file_id,
-                        caption=message.caption,
-                        parse_mode='HTML'
-                    )
-                elif message.video:
-                    # Відправка відео з підписом
-                    await context.bot.send_video(
-                        chat_id=user_id,
-                        video=message.video.file_id,
-                        caption=message.caption,
-                        parse_mode='HTML'
-                    )
-                else:
-                    # Відправка текстового повідомлення
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=message.text,
-                        parse_mode='HTML'
-                    )
-                success += 1
-                
-                # Оновлюємо прогрес кожні 10 повідомлень
-                if i % 10 == 0:
-                    await progress_msg.edit_text(
-                        "📤 Рассылка в процессе...\n"
-                        f"Всего пользователей: {total_users}\n"
-                        f"Успешно отправлено: {success}\n"
-                        f"Ошибок доставки: {failed}"
-                    )
-                
-                # Додаємо затримку щоб уникнути обмежень API
-                await asyncio.sleep(0.05)
-                
-            except Exception as e:
-                failed += 1
-                failed_users.append(user_id)
-                logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
-
-        # Фінальний звіт
-        success_rate = (success / total_users) * 100 if total_users > 0 else 0
-        
-        # Формуємо текст результату
-        result_text = (
-            "✅ Рассылка завершена!\n\n"
-            f"📊 Статистика:\n"
-            f"• Всего пользователей: {total_users}\n"
-            f"• Успешно доставлено: {success}\n"
-            f"• Ошибок доставки: {failed}\n"
-            f"• Процент успеха: {success_rate:.1f}%\n\n"
+        # Зберігаємо розсилку в базі, щоб продовжити її після перезапуску
+        job_id = await db.create_broadcast_job(
+            broadcast_message.kind, broadcast_message.text, broadcast_message.file_id,
+            total_users, progress_msg.chat_id, progress_msg.message_id
         )
+        job = BroadcastJob.from_row(await db.get_broadcast_job(job_id))
 
-        # Додаємо різні емодзі в залежності від успішності
-        if success_rate == 100:
-            result_text = "🚀 " + result_text + "Рассылка выполнена идеально!"
-        elif success_rate >= 90:
-            result_text = "✨ " + result_text + "Рассылка выполнена очень успешно!"
-        elif success_rate >= 75:
-            result_text = "👍 " + result_text + "Рассылка выполнена хорошо."
-        elif success_rate >= 50:
-            result_text = "⚠️ " + result_text + "Рассылка выполнена удовлетворительно."
-        else:
-            result_text = "❌ " + result_text + "Возникли проблемы с рассылкой."
-
-        # Якщо є невдалі відправки, додаємо інформацію про них
-        if failed_users:
-            result_text += "\n⚠️ ID пользователей с ошибками:\n"
-            result_text += ", ".join(map(str, failed_users[:10]))
-            if len(failed_users) > 10:
-                result_text += f"\nи еще {len(failed_users) - 10} пользователей..."
-
-        # Оновлюємо прогрес-повідомлення з фінальним звітом
-        await progress_msg.edit_text(result_text)
+        # Розсилка йде у фоні, адмін одразу повертається в меню
+        spawn_broadcast(context.bot, job)
 
         # Повертаємось в адмін-меню
         context.user_data['state'] = States.ADMIN
         await show_admin_menu(update, context)
-        
+
     except Exception as e:
-        logger.error(f"Ошибка в handle_broadcast_message: {e}", exc_info=True)
+        logger.error(f"Ошибка в send_broadcast: {e}", exc_info=True)
         await update.message.reply_text(
             "❌ Произошла ошибка при рассылке сообщений.\n"
             "Пожалуйста, попробуйте позже или обратитесь к разработчику."
         )
 
+async def run_broadcast(bot, job: BroadcastJob):
+    try:
+        async def show_progress(stats: BroadcastStats):
+            await bot.edit_message_text(
+                "📤 Рассылка в процессе...\n"
+                f"Всего пользователей: {stats.total}\n"
+                f"Успешно отправлено: {stats.success}\n"
+                f"Ошибок доставки: {stats.failed}",
+                chat_id=job.admin_chat_id,
+                message_id=job.progress_message_id
+            )
+
+        stats = await broadcast_engine.run(job, progress=show_progress)
+
+        # Оновлюємо прогрес-повідомлення з фінальним звітом
+        await bot.edit_message_text(
+            format_broadcast_report(stats),
+            chat_id=job.admin_chat_id,
+            message_id=job.progress_message_id
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка в run_broadcast: {e}", exc_info=True)
+
+async def resume_broadcasts(application: Application):
+    """Продолжает рассылки, прерванные перезапуском бота"""
+    for row in await db.get_running_broadcast_jobs():
+        job = BroadcastJob.from_row(row)
+        logger.info(f"Продолжаем рассылку #{job.id} после пользователя {job.last_user_id}")
+        spawn_broadcast(application.bot, job)
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def spawn_broadcast(bot, job: BroadcastJob):
+    spawn_background(run_broadcast(bot, job))
+
+async def post_stop(application: Application):
+    # Прерванные рассылки сохраняют прогресс и продолжатся после перезапуска,
+    # периодические задачи просто останавливаются
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def retry_failed_broadcasts():
+    delivered = await broadcast_engine.retry_failed()
+    if delivered:
+        logger.info(f"Повторная отправка рассылок: доставлено {delivered}")
+
+def format_broadcast_report(stats: BroadcastStats) -> str:
+    # Фінальний звіт
+    success_rate = (stats.success / stats.total) * 100 if stats.total > 0 else 0
+
+    # Формуємо текст результату
+    result_text = (
+        "✅ Рассылка завершена!\n\n"
+        f"📊 Статистика:\n"
+        f"• Всего пользователей: {stats.total}\n"
+        f"• Успешно доставлено: {stats.success}\n"
+        f"• Ошибок доставки: {stats.failed}\n"
+        f"• Пропущено (бот заблокирован): {stats.skipped}\n"
+        f"• Процент успеха: {success_rate:.1f}%\n\n"
+    )
+
+    # Додаємо різні емодзі в залежності від успішності
+    if success_rate == 100:
+        result_text = "🚀 " + result_text + "Рассылка выполнена идеально!"
+    elif success_rate >= 90:
+        result_text = "✨ " + result_text + "Рассылка выполнена очень успешно!"
+    elif success_rate >= 75:
+        result_text = "👍 " + result_text + "Рассылка выполнена хорошо."
+    elif success_rate >= 50:
+        result_text = "⚠️ " + result_text + "Рассылка выполнена удовлетворительно."
+    else:
+        result_text = "❌ " + result_text + "Возникли проблемы с рассылкой."
+
+    # Якщо є невдалі відправки, додаємо інформацію про них
+    failed_users = stats.failed_users
+    if failed_users:
+        result_text += "\n⚠️ ID пользователей с ошибками:\n"
+        result_text += ", ".join(map(str, failed_users[:10]))
+        if len(failed_users) > 10:
+            result_text += f"\nи еще {len(failed_users) - 10} пользователей..."
+
+    return result_text
+
+async def show_delivery_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        query = update.callback_query
+        await query.answer()
+        report = await db.get_delivery_report()
+
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_admin")]
+        ])
+        await query.message.edit_text(
+            "📊 Доставка сообщений:\n\n"
+            f"• Заблокировали бота: {report['blocked']}\n"
+            f"• С ошибками доставки: {report['failing']}\n"
+            f"• Пропущено отправок заблокировавшим: {report['skipped_sends']}",
+            reply_markup=keyboard
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка в show_delivery_report: {e}", exc_info=True)
+
 # Додаємо обробник для кнопки скасування розсилки
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -621,54 +801,16 @@ async def handle_channel_link(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def next_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         query = update.callback_query
-        tasks = context.user_data.get('available_tasks', [])
-        current_index = context.user_data.get('task_index', 0)
-        
-        # Если это последнее задание, начинаем сначала
-        next_index = (current_index + 1) % len(tasks)
-        task = tasks[next_index]
-        
-        # Обновляем индекс
-        context.user_data['task_index'] = next_index
+        # Следующее невыполненное задание после показанного; после последнего начинаем сначала
+        task = await db.get_next_available_task(query.from_user.id, context.user_data.get('task_cursor'))
+        if task is None:
+            await query.answer("Нет доступных заданий", show_alert=True)
+            return
         
-        # Формируем сообщение и клавиатуру как в show_tasks
-        if task['type'] == 'subscribe':
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("👉 Перейти в канал", url=task['extra_data']['channel_link'])],
-                [InlineKeyboardButton("✅ Проверить подписку", callback_data=f"check_sub_{task['id']}")],
-                [InlineKeyboardButton("⏩ Следующее задание", callback_data="next_task")]
-            ])
-            
-            message_text = (
-                f"📋 Задание #{task['id']}\n\n"
-                f"Тип: Подписка на канал\n"
-                f"💎 Награда: {task['reward']} ₽\n\n"
-                f"📝 Описание:\n{task['description']}\n\n"
-                f"✅ Для выполнения задания:\n"
-                f"1. Перейдите по ссылке\n"
-                f"2. Подпишитесь на канал\n"
-                f"3. Нажмите кнопку проверки"
-            )
-        else:
-            # Аналогично для register
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("👉 Перейти к регистрации", url=task['extra_data']['reg_link'])],
-                [InlineKeyboardButton("📸 Отправить скриншот", callback_data=f"send_screenshot_{task['id']}")],
-                [InlineKeyboardButton("⏩ Следующее задание", callback_data="next_task")]
-            ])
-            
-            message_text = (
-                f"📋 Задание #{task['id']}\n\n"
-                f"Тип: Регистрация на сайте\n"
-                f"💎 Награда: {task['reward']} ₽\n\n"
-                f"📝 Описание:\н{task['description']}\n\n"
-                f"✅ Для выполнения задания:\н"
-                f"1. Перейдите по ссылке\n"
-                f"2. Зарегистрируйтесь на сайте\n"
-                f"3. Отправьте скриншот"
-            )
+        context.user_data['task_cursor'] = order_key(task)
         
         # Обновляем сообщение
+        message_text, keyboard = render_task_card(task)
         await query.message.edit_text(
             text=message_text,
             reply_markup=keyboard
@@ -724,11 +866,106 @@ async def handle_send_screenshot(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Ошибка в handle_send_screenshot: {e}", exc_info=True)
         await query.answer("Произошла ошибка при обработке запроса", show_alert=True)
 
+# Фоновые задачи обслуживания
+async def run_periodic(interval: float, job, name: str):
+    """Запускает job() каждые interval секунд, не прерываясь на ошибках"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Ошибка в фоновой задаче {name}: {e}", exc_info=True)
+
+async def compact_balance_ledger():
+    removed = await db.compact_ledger(config['ledger_compaction']['keep_days'])
+    logger.info(f"Журнал баланса сжат, удалено записей: {removed}")
+
+async def clean_screenshots():
+    retention = ScreenshotRetention(db, screenshot_store, **config['screenshot_retention']['policy'])
+    report = await retention.run()
+    logger.info(
+        f"Обслуживание скриншотов: пересжато {report.recompressed}, упаковано {report.packed}, "
+        f"удалено {report.deleted}, освобождено {report.bytes_reclaimed / 1024 / 1024:.1f} МиБ"
+    )
+
+async def sweep_subscriptions():
+    report = await subscription_sweeper.run()
+    logger.info(
+        f"Повторная проверка подписок: проверено {report.checked}, отписались {report.unsubscribed}, "
+        f"ошибок {report.errors}"
+        + (", остановлена из-за лимитов" if report.throttled else "")
+    )
+
+async def log_cache_stats():
+    caches = {**db.cache_stats(), **subscription_checker.cache_stats(), 'task_cards': task_card_stats()}
+    for name, stats in caches.items():
+        logger.info(
+            f"Кэш {name}: размер {stats['size']}, попаданий {stats['hits']}, "
+            f"промахов {stats['misses']}, доля попаданий {stats['hit_rate']:.1%}"
+        )
+    stats = subscription_checker.scheduler.stats()
+    logger.info(
+        f"Проверки подписки: в очереди {stats['in_flight']}, объединено {stats['coalesced']}, "
+        f"отклонено из-за лимитов {stats['throttled']}, RetryAfter {stats['retry_after']}"
+    )
+
+async def post_init(application: Application):
+    global broadcast_engine
+    broadcast_engine = BroadcastEngine(application.bot, db, **config['broadcast'])
+    await resume_broadcasts(application)
+    spawn_background(run_periodic(60, retry_failed_broadcasts, 'retry_failed_broadcasts'))
+
+    spawn_background(run_periodic(
+        config['ledger_compaction']['interval_hours'] * 3600,
+        compact_balance_ledger,
+        'compact_balance_ledger'
+    ))
+    spawn_background(run_periodic(
+        config['screenshot_retention']['interval_hours'] * 3600,
+        clean_screenshots,
+        'clean_screenshots'
+    ))
+    spawn_background(run_periodic(
+        subscription_sweeper.interval_minutes * 60,
+        sweep_subscriptions,
+        'sweep_subscriptions'
+    ))
+    spawn_background(run_periodic(3600, log_cache_stats, 'log_cache_stats'))
+
+    async def evict_idle_sessions():
+        evicted = persistence.evict_idle(application)
+        if evicted:
+            logger.info(f"Выгружено неактивных сессий: {evicted}")
+
+    spawn_background(run_periodic(300, evict_idle_sessions, 'evict_idle_sessions'))
+
+async def post_shutdown(application: Application):
+    # Дописываем сессии и очередь записи, закрываем соединения с базой
+    await persistence.flush()
+    db.close()
+
 # Замените функцию main() на:
 
 def run_bot():
+    # Без секрета webhook принимал бы чужие запросы, а без адреса PTB
+    # зарегистрировал бы в Telegram адрес вида https://0.0.0.0:8443
+    webhook = config['webhook']
+    if webhook['enabled'] and not (webhook['url'] and webhook['secret_token']):
+        raise SystemExit("Для режима webhook нужно задать WEBHOOK_URL и WEBHOOK_SECRET")
+
     # Создаем приложение
-    application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+    builder = (
+        Application.builder()
+        .token(os.getenv('BOT_TOKEN'))
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    # Другой адрес Bot API — например, fake_telegram.py для локальной проверки
+    if config['api_url']:
+        builder = builder.base_url(f"{config['api_url']}/bot").base_file_url(f"{config['api_url']}/file/bot")
+    application = builder.build()
     
     # Базовые команды
     application.add_handler(CommandHandler('start', start))
@@ -740,6 +977,9 @@ def run_bot():
     application.add_handler(CallbackQueryHandler(list_tasks, pattern="^list_tasks$"))
     application.add_handler(CallbackQueryHandler(show_admin_menu, pattern="^back_to_admin$"))
     application.add_handler(CallbackQueryHandler(start_broadcast, pattern="^broadcast$"))
+    application.add_handler(CallbackQueryHandler(show_delivery_report, pattern="^delivery_report$"))
+    application.add_handler(CallbackQueryHandler(show_moderation_queue, pattern="^moderation_(queue|next)$"))
+    application.add_handler(CallbackQueryHandler(handle_moderation_action, pattern="^mq_(approve|reject)_"))
     application.add_handler(CallbackQueryHandler(switch_to_user_mode, pattern="^user_mode$"))
     application.add_handler(CallbackQueryHandler(
         lambda u, c: handle_admin_task_response(u, c, True), 
@@ -754,6 +994,12 @@ def run_bot():
     application.add_handler(CallbackQueryHandler(handle_send_screenshot, pattern="^send_screenshot_"))
     application.add_handler(CallbackQueryHandler(cancel_broadcast, pattern="^cancel_broadcast$"))
     
+    # Сообщение для рассылки перехватывается раньше всех остальных обработчиков
+    application.add_handler(MessageHandler(
+        ((filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO) & filters.User(config['admin_ids']),
+        handle_broadcast_message
+    ), group=-1)
+
     # Обработчики текстовых сообщений с высоким приоритетом
     application.add_handler(MessageHandler(
         filters.Text(["👑 Админ-панель"]) & filters.User(config['admin_ids']),
@@ -807,41 +1053,45 @@ def run_bot():
         pattern="^edit_position_"
     ))
     
-    # Додаємо обробник введення для редагування
-    application.add_handler(MessageHandler(
-        filters.TEXT & filters.User(config['admin_ids']) & 
-        filters.StateFilter('edit_description', 'edit_reward', 'edit_link', 'edit_position'),
-        handle_edit_input
-    ))
+    # Ввод для редактирования заданий обрабатывает handle_admin_input по edit_state
     
-    # Заменяем проблемный обработчик
-    application.add_handler(MessageHandler(
-        filters.TEXT 
-        & filters.User(config['admin_ids']) 
-        & (
-            filters.create(
-                lambda _, ctx: ctx.user_data.get('edit_state') in [
-                    'edit_description', 
-                    'edit_reward', 
-                    'edit_link', 
-                    'edit_position'
-                ]
-            )
-        ),
-        handle_edit_input
-    ))
+    # Запускаем бота: получаем только те типы обновлений, которые обрабатываем
+    allowed_updates = get_allowed_updates(application)
+    if webhook['enabled']:
+        logger.info(f"Бот запущен в режиме webhook на {webhook['listen']}:{webhook['port']}, обновления: {allowed_updates}")
+        application.run_webhook(
+            listen=webhook['listen'],
+            port=webhook['port'],
+            url_path=webhook['url_path'],
+            webhook_url=webhook['url'],
+            secret_token=webhook['secret_token'],
+            max_connections=webhook['max_connections'],
+            allowed_updates=allowed_updates
+        )
+    else:
+        logger.info(f"Бот запущен, обновления: {allowed_updates}")
+        application.run_polling(allowed_updates=allowed_updates)
 
-    # Удаляем дублирующий обработчик
-    # application.add_handler(MessageHandler(
-    #     filters.TEXT 
-    #     & filters.User(config['admin_ids']) 
-    #     & filters.StateFilter(...),
-    #     handle_edit_input
-    # ))
-    
-    # Запускаем бота
-    logger.info("Бот запущен")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+# Типы обновлений, которые получает каждый вид обработчика
+HANDLER_UPDATE_TYPES = [
+    (CommandHandler, [Update.MESSAGE]),
+    (MessageHandler, [Update.MESSAGE]),
+    (CallbackQueryHandler, [Update.CALLBACK_QUERY]),
+]
+
+def get_allowed_updates(application: Application) -> list:
+    """allowed_updates по зарегистрированным обработчикам"""
+    update_types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            for handler_class, types in HANDLER_UPDATE_TYPES:
+                if isinstance(handler, handler_class):
+                    update_types.update(types)
+                    break
+            else:
+                # Неизвестный обработчик — не сужаем список, чтобы ничего не потерять
+                return Update.ALL_TYPES
+    return sorted(update_types)
 
 # Добавьте новую функцию для обработки админ-ввода:
 async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -849,8 +1099,11 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Добавим логирование для отладки
         state = context.user_data.get('state')
         text = update.message.text
-        
-        if state == States.WAITING_TASK_DESCRIPTION:
+
+        if context.user_data.get('edit_state'):
+            await handle_edit_input(update, context)
+
+        elif state == States.WAITING_TASK_DESCRIPTION:
             context.user_data['new_task_description'] = text
             context.user_data['state'] = States.WAITING_TASK_REWARD
             await update.message.reply_text("Введите награду за задание (в рублях):")
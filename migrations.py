@@ -0,0 +1,303 @@
+"""Версионные миграции схемы базы данных.
+
+Текущая версия схемы хранится в PRAGMA user_version. При старте все
+недостающие миграции применяются по порядку в одной транзакции. Индексы,
+которые нужны только для скорости, строятся уже после старта — каждый в
+своей короткой транзакции, чтобы не держать блокировку записи долго.
+"""
+import logging
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Cursor], None]
+    # CREATE INDEX IF NOT EXISTS ..., которые строятся после старта
+    online_indexes: List[str] = field(default_factory=list)
+
+
+def _initial_schema(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        description TEXT NOT NULL,
+        reward REAL NOT NULL,
+        order_num INTEGER,
+        extra_data TEXT,
+        is_active BOOLEAN DEFAULT 1
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        balance REAL DEFAULT 0,
+        current_task INTEGER DEFAULT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS completed_tasks (
+        user_id INTEGER,
+        task_id INTEGER,
+        status TEXT,
+        screenshot TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+
+
+def _completed_tasks_unique(cursor):
+    # Перед уникальным индексом убираем дубли, оставляя последнюю запись
+    cursor.execute('''
+        DELETE FROM completed_tasks
+        WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM completed_tasks GROUP BY user_id, task_id
+        )
+    ''')
+    # На этот индекс опираются ON CONFLICT в save_screenshot и mark_task_completed,
+    # поэтому он строится сразу, а не в фоне
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_completed_tasks_user_task
+        ON completed_tasks (user_id, task_id)
+    ''')
+
+
+def _balance_ledger(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        reason TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    # Текущие балансы переносим в журнал начальными записями
+    cursor.execute('''
+        INSERT INTO balance_ledger (user_id, amount, reason)
+        SELECT user_id, balance, 'opening' FROM users WHERE balance != 0
+    ''')
+
+
+def _broadcast_jobs(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        text TEXT,
+        file_id TEXT,
+        status TEXT NOT NULL DEFAULT 'running',
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        success INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        admin_chat_id INTEGER,
+        progress_message_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        job_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        next_attempt_at DATETIME,
+        error TEXT,
+        PRIMARY KEY (job_id, user_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _broadcast_segment(cursor):
+    # Фильтры сегмента (JSON с аргументами Database.iter_user_ids)
+    cursor.execute('ALTER TABLE broadcast_jobs ADD COLUMN segment TEXT')
+
+
+def _delivery_health(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS delivery_health (
+        user_id INTEGER PRIMARY KEY,
+        last_success_at DATETIME,
+        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        blocked_at DATETIME,
+        skipped_sends INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('ALTER TABLE broadcast_jobs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0')
+
+
+def _screenshot_file_id(cursor):
+    cursor.execute('ALTER TABLE completed_tasks ADD COLUMN file_id TEXT')
+
+
+def _screenshot_blobs(cursor):
+    # completed_tasks.screenshot теперь хранит digest файла в ScreenshotStore
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS screenshot_blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        phash_b0 INTEGER,
+        phash_b1 INTEGER,
+        phash_b2 INTEGER,
+        phash_b3 INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''')
+
+
+def _screenshot_retention(cursor):
+    cursor.execute('ALTER TABLE completed_tasks ADD COLUMN reviewed_at DATETIME')
+    # state: loose — отдельный файл, packed — упакован в сегмент, deleted — удалён
+    cursor.execute("ALTER TABLE screenshot_blobs ADD COLUMN state TEXT NOT NULL DEFAULT 'loose'")
+    cursor.execute('ALTER TABLE screenshot_blobs ADD COLUMN segment TEXT')
+    cursor.execute('ALTER TABLE screenshot_blobs ADD COLUMN recompressed INTEGER NOT NULL DEFAULT 0')
+
+
+def _moderation_claims(cursor):
+    # Кто из админов проверяет скриншот и до какого времени
+    cursor.execute('ALTER TABLE completed_tasks ADD COLUMN claimed_by INTEGER')
+    cursor.execute('ALTER TABLE completed_tasks ADD COLUMN claim_expires_at DATETIME')
+
+
+def _subscription_sweeps(cursor):
+    # Когда подписка по выполненному заданию проверялась в последний раз
+    cursor.execute('ALTER TABLE completed_tasks ADD COLUMN last_verified_at DATETIME')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS subscription_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        amount REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _user_sessions(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+MIGRATIONS = [
+    Migration(1, 'Базовые таблицы', _initial_schema),
+    Migration(
+        2, 'Индексы поиска доступных заданий', _completed_tasks_unique,
+        online_indexes=[
+            'CREATE INDEX IF NOT EXISTS idx_completed_tasks_task_user '
+            'ON completed_tasks (task_id, user_id)',
+            'CREATE INDEX IF NOT EXISTS idx_tasks_active_order '
+            'ON tasks (is_active, order_num) WHERE is_active = 1',
+        ],
+    ),
+    Migration(
+        3, 'Журнал изменений баланса', _balance_ledger,
+        online_indexes=[
+            'CREATE INDEX IF NOT EXISTS idx_balance_ledger_created '
+            'ON balance_ledger (created_at, user_id)',
+        ],
+    ),
+    Migration(
+        4, 'Сохраняемые задания рассылки', _broadcast_jobs,
+        online_indexes=[
+            'CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_retry '
+            "ON broadcast_recipients (next_attempt_at) WHERE status = 'failed'",
+        ],
+    ),
+    Migration(5, 'Сегмент получателей рассылки', _broadcast_segment),
+    Migration(
+        6, 'Состояние доставки сообщений пользователям', _delivery_health,
+        online_indexes=[
+            'CREATE INDEX IF NOT EXISTS idx_delivery_health_blocked '
+            'ON delivery_health (user_id) WHERE blocked = 1',
+        ],
+    ),
+    Migration(7, 'file_id скриншота в Telegram', _screenshot_file_id),
+    Migration(
+        8, 'Хранилище скриншотов по содержимому', _screenshot_blobs,
+        online_indexes=[
+            'CREATE INDEX IF NOT EXISTS idx_completed_tasks_screenshot ON completed_tasks (screenshot)',
+        ] + [
+            f'CREATE INDEX IF NOT EXISTS idx_screenshot_blobs_phash_b{band} '
+            f'ON screenshot_blobs (phash_b{band}) WHERE phash_b{band} IS NOT NULL'
+            for band in range(4)
+        ],
+    ),
+    Migration(
+        9, 'Решение по скриншоту и состояние файла в хранилище', _screenshot_retention,
+        online_indexes=[
+            "CREATE INDEX IF NOT EXISTS idx_screenshot_blobs_loose "
+            "ON screenshot_blobs (created_at) WHERE state = 'loose'",
+        ],
+    ),
+    Migration(
+        10, 'Очередь проверки скриншотов', _moderation_claims,
+        online_indexes=[
+            "CREATE INDEX IF NOT EXISTS idx_completed_tasks_pending "
+            "ON completed_tasks (timestamp) WHERE status = 'pending'",
+        ],
+    ),
+    Migration(
+        11, 'Повторная проверка подписок', _subscription_sweeps,
+        online_indexes=[
+            "CREATE INDEX IF NOT EXISTS idx_completed_tasks_completed "
+            "ON completed_tasks (timestamp) WHERE status = 'completed'",
+        ],
+    ),
+    Migration(12, 'Сессии пользователей (user_data)', _user_sessions),
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[Migration] = MIGRATIONS) -> List[str]:
+    """Применяет недостающие миграции одной транзакцией.
+
+    Возвращает индексы всех миграций для фоновой сборки: CREATE INDEX IF NOT
+    EXISTS идемпотентен, так что прерванная сборка просто повторится.
+    """
+    current = get_version(conn)
+    pending = [m for m in sorted(migrations, key=lambda m: m.version) if m.version > current]
+
+    if pending:
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for migration in pending:
+                logger.info(f"Миграция {migration.version}: {migration.description}")
+                migration.apply(cursor)
+            cursor.execute(f'PRAGMA user_version = {pending[-1].version}')
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = isolation_level
+
+    return [index for m in migrations for index in m.online_indexes]
+
+
+def build_index(conn: sqlite3.Connection, statement: str):
+    """Строит один индекс в отдельной короткой транзакции"""
+    conn.execute(statement)
+    conn.commit()
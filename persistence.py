@@ -0,0 +1,145 @@
+"""Хранение user_data в SQLite для python-telegram-bot.
+
+Состояние диалогов (state, id текущего задания, поля нового задания)
+переживает перезапуск бота. Сессия пользователя загружается из базы при
+первом его обновлении, а не вся таблица при старте. Изменения копятся и
+пишутся одной транзакцией не чаще раза в flush_delay секунд; неизменённые
+сессии не пишутся вовсе. Сессии, неактивные дольше idle_timeout,
+выгружаются из памяти и при следующем обращении читаются из базы снова.
+
+chat_data, bot_data и callback_data бот не использует и не сохраняет.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, db, update_interval: float = 5, flush_delay: float = 1.0, idle_timeout: float = 1800):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.flush_delay = flush_delay
+        self.idle_timeout = idle_timeout
+        # Ещё не записанные сессии; None — удалить
+        self._dirty: Dict[int, Optional[str]] = {}
+        # Хеш последней записанной сессии, чтобы не писать неизменённые
+        self._fingerprints: Dict[int, int] = {}
+        # Загруженные в память сессии и время последнего обращения
+        self._last_seen: Dict[int, float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Сессии подгружаются по одной в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        loaded = user_id in self._last_seen
+        self._last_seen[user_id] = time.monotonic()
+        if loaded or user_data:
+            return
+        if user_id in self._dirty:
+            stored = self._dirty[user_id]
+        else:
+            stored = await self.db.load_user_session(user_id)
+        if stored:
+            user_data.update(json.loads(stored))
+            self._fingerprints[user_id] = hash(stored)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        stored = json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else None
+        fingerprint = hash(stored)
+        if self._fingerprints.get(user_id) == fingerprint:
+            return
+        self._fingerprints[user_id] = fingerprint
+        self._dirty[user_id] = stored
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._fingerprints.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        self._dirty[user_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty:
+            return
+        sessions, self._dirty = self._dirty, {}
+        try:
+            await self.db.save_user_sessions(sessions)
+        except Exception:
+            # Более новые изменения, пришедшие за время записи, не затираем
+            for user_id, stored in sessions.items():
+                self._dirty.setdefault(user_id, stored)
+            raise
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_dirty()
+
+    def evict_idle(self, application: Application) -> int:
+        """Выгружает из памяти сессии, неактивные дольше idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for user_id, last_seen in list(self._last_seen.items()):
+            if last_seen >= cutoff:
+                continue
+            del self._last_seen[user_id]
+            self._fingerprints.pop(user_id, None)
+            user_data = application.user_data.get(user_id)
+            if user_data is not None:
+                user_data.clear()
+            evicted += 1
+        return evicted
+
+    # Остальные данные не сохраняются
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
@@ -0,0 +1,154 @@
+"""Ограничители частоты запросов к Bot API."""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable
+
+from telegram.error import RetryAfter
+
+from cache import LRUCache
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Корзина токенов: в среднем rate запросов в секунду, всплеск до capacity.
+
+    pause() останавливает выдачу токенов целиком — так обрабатывается
+    RetryAfter, который Telegram возвращает на весь бот, а не на один чат.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Забирает токены без ожидания, если они есть"""
+        now = time.monotonic()
+        if now < self._resume_at or self._lock.locked():
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._resume_at:
+                    await asyncio.sleep(self._resume_at - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        now = time.monotonic()
+        self._resume_at = max(self._resume_at, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+
+class PerChatLimiter:
+    """Минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, interval: float = 1.0, max_chats: int = 100_000):
+        self.interval = interval
+        self._last_sent = LRUCache(max_chats, ttl=interval)
+
+    async def wait(self, chat_id: Hashable):
+        last_sent = self._last_sent.peek(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._last_sent.set(chat_id, time.monotonic())
+
+
+class Throttled(Exception):
+    """Запрос не выполнен из-за лимитов: очередь заполнена или ждать слишком долго"""
+
+
+class RequestScheduler:
+    """Общая очередь запросов одного бота к Bot API.
+
+    Запросы проходят через корзину токенов. Одинаковые запросы (с одним
+    ключом), пока первый ещё выполняется, получают его результат, а не идут
+    в API повторно. На RetryAfter выдача токенов останавливается для всех.
+    Одновременно ожидают не больше max_pending разных запросов, и ни один
+    не ждёт дольше max_wait секунд — иначе Throttled.
+    """
+
+    def __init__(self, rate: float, max_pending: int = 500, max_wait: float = 10.0, max_retries: int = 2):
+        self.bucket = TokenBucket(rate)
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+        self.throttled = 0
+        self.retry_after = 0
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            if len(self._in_flight) >= self.max_pending:
+                self.throttled += 1
+                raise Throttled()
+            task = asyncio.ensure_future(self._execute(call))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # Отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and isinstance(task.exception(), Throttled):
+            self.throttled += 1
+
+    async def _execute(self, call: Callable[[], Awaitable]):
+        deadline = time.monotonic() + self.max_wait
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.wait_for(self.bucket.acquire(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                raise Throttled()
+            try:
+                return await call()
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                self.bucket.pause(seconds)
+                self.retry_after += 1
+                if attempt == self.max_retries or time.monotonic() + seconds > deadline:
+                    raise Throttled() from e
+
+    def idle(self) -> bool:
+        """Нет ожидающих запросов — можно выполнить фоновый"""
+        return not self._in_flight
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._in_flight),
+            'coalesced': self.coalesced,
+            'throttled': self.throttled,
+            'retry_after': self.retry_after,
+        }
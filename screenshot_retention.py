@@ -0,0 +1,101 @@
+"""Обслуживание хранилища скриншотов.
+
+После решения админа скриншот нужен только для истории, поэтому фоновая
+задача:
+- уменьшает и пересжимает проверенные скриншоты (если есть Pillow);
+- упаковывает давно одобренные в сжатые архивы-сегменты, чтобы в
+  каталогах не копились миллионы мелких файлов;
+- удаляет отклонённые после срока хранения.
+Работа с файлами идёт в отдельном потоке, за один запуск обрабатывается
+не больше batch_size файлов на каждом шаге.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from screenshot_store import ScreenshotStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetentionReport:
+    recompressed: int = 0
+    packed: int = 0
+    deleted: int = 0
+    bytes_reclaimed: int = 0
+
+
+class ScreenshotRetention:
+    def __init__(self, db, store: ScreenshotStore, recompress_max_side: int = 1280,
+                 recompress_quality: int = 70, pack_after_days: int = 30,
+                 reject_retention_days: int = 14, batch_size: int = 500):
+        self.db = db
+        self.store = store
+        self.recompress_max_side = recompress_max_side
+        self.recompress_quality = recompress_quality
+        self.pack_after_days = pack_after_days
+        self.reject_retention_days = reject_retention_days
+        self.batch_size = batch_size
+
+    async def run(self) -> RetentionReport:
+        report = RetentionReport()
+        await self._delete_rejected(report)
+        await self._recompress(report)
+        await self._pack(report)
+        return report
+
+    async def _recompress(self, report: RetentionReport):
+        for digest in await self.db.get_blobs_to_recompress(self.batch_size):
+            try:
+                before = await asyncio.to_thread(self._file_size, digest)
+                size = await asyncio.to_thread(
+                    self.store.recompress, digest, self.recompress_max_side, self.recompress_quality
+                )
+            except FileNotFoundError:
+                logger.warning(f"Скриншот {digest} отсутствует в хранилище")
+                continue
+            except Exception as e:
+                logger.warning(f"Не удалось пересжать скриншот {digest}: {e}")
+                size = None
+            # Без Pillow или без выигрыша в размере файл больше не трогаем
+            await self.db.mark_blob_recompressed(digest, size)
+            if size is not None:
+                report.recompressed += 1
+                report.bytes_reclaimed += before - size
+
+    async def _pack(self, report: RetentionReport):
+        digests = await self.db.get_blobs_to_pack(self.pack_after_days, self.batch_size)
+        digests = [digest for digest in digests if await asyncio.to_thread(self._exists, digest)]
+        if not digests:
+            return
+        segment = time.strftime('%Y%m%d-%H%M%S') + '.tar.gz'
+        segment_size = await asyncio.to_thread(self.store.pack, digests, segment)
+        freed = 0
+        async with self.store.lock:
+            packed = await self.db.mark_blobs_packed(digests, segment, self.pack_after_days)
+            for digest in packed:
+                freed += await asyncio.to_thread(self.store.remove, digest)
+        if not packed:
+            # Все скриншоты снова понадобились, пока собирался архив
+            await asyncio.to_thread(os.remove, self.store.segment_path(segment))
+            return
+        report.packed += len(packed)
+        report.bytes_reclaimed += freed - segment_size
+
+    async def _delete_rejected(self, report: RetentionReport):
+        digests = await self.db.get_blobs_to_delete(self.reject_retention_days, self.batch_size)
+        if not digests:
+            return
+        async with self.store.lock:
+            for digest in await self.db.mark_blobs_deleted(digests, self.reject_retention_days):
+                report.bytes_reclaimed += await asyncio.to_thread(self.store.remove, digest)
+                report.deleted += 1
+
+    def _file_size(self, digest: str) -> int:
+        return os.path.getsize(self.store.path(digest))
+
+    def _exists(self, digest: str) -> bool:
+        return os.path.exists(self.store.path(digest))
@@ -0,0 +1,169 @@
+"""Хранилище скриншотов по содержимому.
+
+Файл сохраняется под своим SHA-256: root/ab/cd/<digest>.jpg. Одинаковые
+изображения хранятся один раз, повторная отправка не затирает старый
+файл, а каталоги не разрастаются до миллионов файлов в одной папке.
+
+Для поиска повторно использованных скриншотов считается перцептивный
+хеш (dHash, 64 бита) — он почти не меняется при пересжатии и небольшом
+изменении размера. Хеш делится на 4 полосы по 16 бит: если два хеша
+отличаются не больше чем в 3 битах, хотя бы одна полоса у них совпадает,
+поэтому кандидатов можно найти по индексу полос без перебора всех
+хешей. Для dHash нужен Pillow; без него ищутся только точные копии.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import tempfile
+from typing import List, Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_digest(ref: Optional[str]) -> bool:
+    return bool(ref) and len(ref) == 64 and all(c in '0123456789abcdef' for c in ref)
+
+
+def perceptual_hash(data: bytes) -> Optional[int]:
+    """dHash: сравнение яркости соседних пикселей уменьшенной копии 9x8"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            pixels = list(image.convert('L').resize((9, 8)).getdata())
+    except Exception as e:
+        logger.warning(f"Не удалось посчитать хеш изображения: {e}")
+        return None
+    phash = 0
+    for row in range(8):
+        for col in range(8):
+            phash = (phash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return phash
+
+
+def phash_bands(phash: int) -> List[int]:
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(phash >> (band * PHASH_BAND_BITS)) & mask for band in range(PHASH_BANDS)]
+
+
+def phash_from_bands(bands) -> int:
+    phash = 0
+    for band, value in enumerate(bands):
+        phash |= value << (band * PHASH_BAND_BITS)
+    return phash
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class ScreenshotStore:
+    def __init__(self, root: str = 'screenshots'):
+        self.root = root
+        # Сохранение нового скриншота и упаковка/удаление файлов обслуживанием
+        # идут под этой блокировкой, чтобы обслуживание не удалило файл,
+        # который только что снова понадобился
+        self.lock = asyncio.Lock()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.jpg")
+
+    def resolve(self, ref: Optional[str]) -> Optional[str]:
+        """Путь к файлу по ссылке из completed_tasks.screenshot (digest или старый путь)"""
+        if not ref:
+            return None
+        return self.path(ref) if is_digest(ref) else ref
+
+    def segment_path(self, segment: str) -> str:
+        return os.path.join(self.root, 'archive', segment)
+
+    def put(self, data: bytes) -> str:
+        """Сохраняет изображение, если такого ещё нет; возвращает digest"""
+        digest = content_digest(data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        self._write_atomic(path, data)
+        return digest
+
+    def _write_atomic(self, path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и переименовываем — недописанный файл не появится под digest
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, digest: str, segment: Optional[str] = None) -> bytes:
+        """Содержимое файла; segment — архив, в который файл упакован"""
+        if segment:
+            with tarfile.open(self.segment_path(segment)) as tar:
+                return tar.extractfile(f"{digest}.jpg").read()
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def recompress(self, digest: str, max_side: int, quality: int) -> Optional[int]:
+        """Уменьшает и пересжимает файл на месте; возвращает новый размер или None.
+
+        Digest остаётся digest исходного файла: по нему находятся повторные
+        загрузки того же изображения.
+        """
+        if Image is None:
+            return None
+        path = self.path(digest)
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+            image.thumbnail((max_side, max_side))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) >= os.path.getsize(path):
+            return None
+        self._write_atomic(path, data)
+        return len(data)
+
+    def pack(self, digests: List[str], segment: str) -> int:
+        """Упаковывает файлы в сжатый архив-сегмент; возвращает его размер.
+
+        Исходные файлы не удаляются — это делает remove() после того, как
+        сегмент записан в базу.
+        """
+        path = self.segment_path(segment)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with tarfile.open(tmp_path, 'w:gz') as tar:
+            for digest in digests:
+                tar.add(self.path(digest), arcname=f"{digest}.jpg")
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def remove(self, digest: str) -> int:
+        """Удаляет файл; возвращает освобождённые байты"""
+        path = self.path(digest)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
@@ -0,0 +1,227 @@
+"""Настройки подключения к SQLite, пул чтения и поток групповой записи."""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StorageProfile:
+    """Профиль хранилища: режим журнала, PRAGMA и размер пула чтения"""
+    journal_mode: str = 'WAL'
+    synchronous: str = 'NORMAL'
+    mmap_size: int = 256 * 1024 * 1024  # байт
+    cache_size: int = -64000  # отрицательное значение — размер в КиБ
+    busy_timeout: int = 5000  # мс
+    read_pool_size: int = 4
+    # Групповая фиксация: записи копятся до commit_window_ms или commit_max_batch
+    commit_window_ms: float = 5
+    commit_max_batch: int = 256
+
+    def connect(self, path: str, readonly: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        if not readonly:
+            # Режим журнала хранится в самом файле базы, его ставит писатель
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        if readonly:
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+
+class ReadPool:
+    """Потоки для чтения, у каждого потока своё соединение.
+
+    В режиме WAL читатели видят последнюю зафиксированную версию базы
+    и не ждут, пока поток записи закончит свою транзакцию.
+    """
+
+    def __init__(self, path: str, profile: StorageProfile):
+        self.path = path
+        self.profile = profile
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, profile.read_pool_size), thread_name_prefix='db-read'
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.profile.connect(self.path, readonly=True)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func, args):
+        return func(self._connection(), *args)
+
+    async def run(self, func, *args):
+        """Выполняет func(conn, *args) на одном из соединений пула"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+class _WriteRequest:
+    __slots__ = ('func', 'args', 'future', 'exclusive')
+
+    def __init__(self, func, args, exclusive):
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.exclusive = exclusive
+
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Поток записи с групповой фиксацией.
+
+    Операции из очереди собираются в пачку (окно commit_window_ms или
+    commit_max_batch штук) и выполняются в одной транзакции: одна
+    фиксация вместо фиксации на каждую запись. Каждая операция обёрнута
+    в SAVEPOINT, поэтому ошибка одной не откатывает остальные. Future
+    операции завершается только после COMMIT всей пачки.
+
+    Операции не должны вызывать conn.commit() — фиксирует сам писатель.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 window_ms: float = 5, max_batch: int = 256):
+        self._window = window_ms / 1000
+        self._max_batch = max(1, max_batch)
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        ready = Future()
+        self._thread = threading.Thread(
+            target=self._loop, args=(connect, ready), name='db-writer', daemon=True
+        )
+        self._thread.start()
+        self.conn = ready.result()
+
+    def submit(self, func, *args) -> Future:
+        """Ставит func(conn, *args) в очередь на групповую фиксацию"""
+        return self._put(func, args, exclusive=False)
+
+    def submit_exclusive(self, func, *args) -> Future:
+        """Выполняет func(conn, *args) вне пачек; func сама управляет транзакцией"""
+        return self._put(func, args, exclusive=True)
+
+    def call(self, func, *args):
+        return self.submit(func, *args).result()
+
+    def call_exclusive(self, func, *args):
+        return self.submit_exclusive(func, *args).result()
+
+    async def run(self, func, *args):
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def _put(self, func, args, exclusive):
+        if self._closed:
+            raise RuntimeError('GroupCommitWriter закрыт')
+        request = _WriteRequest(func, args, exclusive)
+        self._queue.put(request)
+        return request.future
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _loop(self, connect, ready):
+        try:
+            conn = connect()
+            # Транзакциями управляем сами: BEGIN/COMMIT на каждую пачку
+            conn.isolation_level = None
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(conn)
+
+        pending = None
+        while True:
+            request = pending if pending is not None else self._queue.get()
+            pending = None
+            if request is _STOP:
+                break
+            if request.exclusive:
+                self._run_exclusive(conn, request)
+                continue
+
+            batch = [request]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP or request.exclusive:
+                    pending = request
+                    break
+                batch.append(request)
+            self._commit_batch(conn, batch)
+
+        conn.close()
+
+    def _run_exclusive(self, conn, request):
+        if not request.future.set_running_or_notify_cancel():
+            return
+        try:
+            request.future.set_result(request.func(conn, *request.args))
+        except Exception as e:
+            request.future.set_exception(e)
+
+    def _commit_batch(self, conn, batch):
+        # Отменённые до начала выполнения операции пропускаем
+        batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        results = []
+        try:
+            conn.execute('BEGIN')
+            for request in batch:
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    results.append((request.func(conn, *request.args), None))
+                    conn.execute('RELEASE write_op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_op')
+                    conn.execute('RELEASE write_op')
+                    results.append((None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"Ошибка при фиксации пачки из {len(batch)} записей: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, (result, error) in zip(batch, results):
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(result)
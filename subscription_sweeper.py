@@ -0,0 +1,84 @@
+"""Повторная проверка подписок по выполненным заданиям.
+
+Награда за подписку начисляется один раз, а отписаться пользователь
+может сразу после этого. Фоновая задача периодически перепроверяет
+выполнения — сначала самые свежие — и для отписавшихся списывает
+награду или помечает выполнение для админа.
+
+Проверки идут по одной и только когда планировщик бота проверки
+свободен, поэтому нажатия «Проверить подписку» их не ждут. За час
+делается не больше hourly_budget запросов. Прогресс хранится в
+completed_tasks.last_verified_at, так что после перезапуска проверка
+продолжается с того же места.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from check_bot import SubscriptionChecker, SubscriptionStatus, channel_username
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepReport:
+    checked: int = 0
+    unsubscribed: int = 0
+    errors: int = 0
+    throttled: bool = False
+
+
+class SubscriptionSweeper:
+    def __init__(self, db, checker: SubscriptionChecker, hourly_budget: int = 600,
+                 interval_minutes: int = 10, reverify_days: int = 7, max_age_days: int = 30,
+                 clawback: bool = False, flush_size: int = 50):
+        self.db = db
+        self.checker = checker
+        self.interval_minutes = interval_minutes
+        # Запуск раз в interval_minutes тратит свою долю часового бюджета
+        self.run_budget = max(1, hourly_budget * interval_minutes // 60)
+        self.reverify_days = reverify_days
+        self.max_age_days = max_age_days
+        self.clawback = clawback
+        self.flush_size = flush_size
+
+    async def run(self) -> SweepReport:
+        report = SweepReport()
+        due = await self.db.get_subscriptions_to_verify(self.run_budget, self.reverify_days, self.max_age_days)
+        verified, unsubscribed = [], []
+
+        for user_id, task_id in due:
+            task = await self.db.get_task_by_id(task_id)
+            if task is None:
+                continue
+            # Интерактивные проверки важнее — ждём, пока очередь освободится
+            while not self.checker.scheduler.idle():
+                await asyncio.sleep(0.5)
+
+            status = await self.checker.get_subscription_status(channel_username(task), user_id)
+            if status == SubscriptionStatus.THROTTLED:
+                report.throttled = True
+                break
+            if status == SubscriptionStatus.ERROR:
+                # last_verified_at не меняем — следующий запуск проверит снова
+                report.errors += 1
+                continue
+            report.checked += 1
+            if status == SubscriptionStatus.NOT_SUBSCRIBED:
+                unsubscribed.append((user_id, task_id))
+            else:
+                verified.append((user_id, task_id))
+
+            if len(verified) + len(unsubscribed) >= self.flush_size:
+                report.unsubscribed += await self._flush(verified, unsubscribed)
+
+        report.unsubscribed += await self._flush(verified, unsubscribed)
+        return report
+
+    async def _flush(self, verified: list, unsubscribed: list) -> int:
+        if not verified and not unsubscribed:
+            return 0
+        events = await self.db.save_subscription_checks(verified, unsubscribed, self.clawback)
+        verified.clear()
+        unsubscribed.clear()
+        return len(events)
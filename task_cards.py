@@ -0,0 +1,80 @@
+"""Карточка задания: текст сообщения и клавиатура.
+
+Карточка строится один раз на версию задания. Словари заданий из
+TaskCatalog не изменяются и создаются заново при каждом изменении
+заданий, поэтому версию определяет сам объект задания: кэш хранит его
+вместе с карточкой и при несовпадении строит карточку заново.
+"""
+from typing import Dict, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import LRUCache
+
+_cards = LRUCache(1024)
+
+
+def _subscribe_card(task: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    channel_link = task['extra_data'].get('channel_link', '')
+    if not channel_link.startswith('https://'):
+        channel_link = f"https://t.me/{channel_link.lstrip('@')}"
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("👉 Перейти в канал", url=channel_link)],
+        [InlineKeyboardButton("✅ Проверить подписку", callback_data=f"check_sub_{task['id']}")],
+        [InlineKeyboardButton("⏩ Следующее задание", callback_data="next_task")]
+    ])
+    text = (
+        f"📋 Задание #{task['id']}\n\n"
+        f"Тип: Подписка на канал\n"
+        f"💎 Награда: {task['reward']} ₽\n\n"
+        f"📝 Описание:\n{task['description']}\n\n"
+        f"✅ Для выполнения задания:\n"
+        f"1. Перейдите по ссылке\n"
+        f"2. Подпишитесь на канал\n"
+        f"3. Нажмите кнопку проверки"
+    )
+    return text, keyboard
+
+
+def _register_card(task: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    reg_link = task['extra_data'].get('reg_link', '')
+    if not reg_link.startswith(('http://', 'https://')):
+        reg_link = f"https://{reg_link}"
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("👉 Перейти к регистрации", url=reg_link)],
+        [InlineKeyboardButton("📸 Отправить скриншот", callback_data=f"send_screenshot_{task['id']}")],
+        [InlineKeyboardButton("⏩ Следующее задание", callback_data="next_task")]
+    ])
+    text = (
+        f"📋 Задание #{task['id']}\n\n"
+        f"Тип: Регистрация на сайте\n"
+        f"💎 Награда: {task['reward']} ₽\n\n"
+        f"📝 Описание:\n{task['description']}\n\n"
+        f"✅ Для выполнения задания:\n"
+        f"1. Перейдите по ссылке\n"
+        f"2. Зарегистрируйтесь на сайте\n"
+        f"3. Отправьте скриншот"
+    )
+    return text, keyboard
+
+
+def build_task_card(task: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    if task['type'] == 'subscribe':
+        return _subscribe_card(task)
+    return _register_card(task)
+
+
+def render_task_card(task: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура карточки задания из кэша"""
+    cached = _cards.get(task['id'])
+    if cached is not None and cached[0] is task:
+        return cached[1]
+    card = build_task_card(task)
+    _cards.set(task['id'], (task, card))
+    return card
+
+
+def cache_stats():
+    return _cards.stats()
@@ -0,0 +1,60 @@
+"""Каталог заданий в памяти.
+
+Таблица tasks меняется только из админ-панели, поэтому она целиком
+загружается один раз и сбрасывается при каждом изменении заданий.
+Словари заданий общие для всех обработчиков — их нельзя изменять.
+"""
+import json
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+
+def task_from_row(row) -> Dict:
+    """Строка tasks (id, type, description, reward, order_num, extra_data, is_active) в словарь"""
+    return {
+        'id': row[0],
+        'type': row[1],
+        'description': row[2],
+        'reward': row[3],
+        'order_num': row[4],
+        'extra_data': json.loads(row[5]) if row[5] else {},
+        'is_active': bool(row[6]),
+    }
+
+
+def order_key(task: Dict) -> tuple:
+    # Задания без позиции идут последними, при равной позиции — по id
+    return (task['order_num'] is None, task['order_num'] or 0, task['id'])
+
+
+class TaskCatalog:
+    def __init__(self, tasks: List[Dict]):
+        self._by_id = {task['id']: task for task in tasks}
+        # Активные задания в порядке показа пользователю
+        self.active = sorted((task for task in tasks if task['is_active']), key=order_key)
+        self._keys = [order_key(task) for task in self.active]
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        return self._by_id.get(task_id)
+
+    def reward(self, task_id: int) -> float:
+        task = self._by_id.get(task_id)
+        return task['reward'] if task else 0.0
+
+    def available(self, completed_mask: int) -> List[Dict]:
+        """Активные задания, бит которых не установлен в маске выполненных"""
+        return [task for task in self.active if not (completed_mask >> task['id']) & 1]
+
+    def next_available(self, completed_mask: int, after: Optional[tuple] = None) -> Optional[Dict]:
+        """Следующее по порядку невыполненное задание после позиции after, с переходом в начало.
+
+        after — ключ порядка order_key показанного задания. Позиция ищется
+        двоичным поиском по ключу, а не по id, поэтому задание, удалённое
+        или изменённое после показа, не сбивает листание.
+        """
+        start = bisect_right(self._keys, tuple(after)) if after else 0
+        for index in range(start, start + len(self.active)):
+            task = self.active[index % len(self.active)]
+            if not (completed_mask >> task['id']) & 1:
+                return task
+        return None
@@ -0,0 +1,76 @@
+"""Повторные и одновременные одобрения не начисляют награду дважды."""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+REWARD = 10.0
+USERS = range(1, 51)
+
+
+class ApprovalIdempotencyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.task_id = await self.db.add_task('register', 'Регистрация', REWARD, {'reg_link': 'example.com'})
+        for user_id in USERS:
+            self.assertTrue(await self.db.save_screenshot(user_id, self.task_id, file_id=f'file{user_id}'))
+
+    async def asyncTearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def ledger(self):
+        return dict(self.db.conn.execute(
+            "SELECT user_id, COUNT(*) FROM balance_ledger WHERE reason = ? GROUP BY user_id",
+            (f'task:{self.task_id}',)
+        ).fetchall())
+
+    async def assert_paid_once(self):
+        self.assertEqual(self.ledger(), {user_id: 1 for user_id in USERS})
+        for user_id in USERS:
+            self.assertEqual(await self.db.get_balance(user_id), REWARD)
+
+    async def test_concurrent_reviews_credit_once(self):
+        # Несколько админов одновременно жмут «Принять» по одним и тем же выполнениям
+        clicks = [
+            self.db.review_screenshots(admin_id, [(user_id, self.task_id)], True)
+            for user_id in USERS for admin_id in (100, 200, 300)
+        ] + [
+            self.db.review_screenshots(admin_id, [(user_id, self.task_id) for user_id in USERS], True)
+            for admin_id in (100, 200)
+        ]
+        results = await asyncio.gather(*clicks)
+
+        reviewed = [item for result in results for item in result]
+        self.assertEqual(len(reviewed), len(USERS))
+        await self.assert_paid_once()
+
+    async def test_approved_screenshot_cannot_be_resubmitted(self):
+        await self.db.review_screenshots(100, [(user_id, self.task_id) for user_id in USERS], True)
+
+        for user_id in USERS:
+            self.assertFalse(await self.db.save_screenshot(user_id, self.task_id, file_id=f'again{user_id}'))
+        self.assertEqual(
+            await self.db.review_screenshots(100, [(user_id, self.task_id) for user_id in USERS], True), []
+        )
+        statuses = {row[0] for row in self.db.conn.execute(
+            'SELECT status FROM completed_tasks WHERE task_id = ?', (self.task_id,)
+        )}
+        self.assertEqual(statuses, {'approved'})
+        await self.assert_paid_once()
+
+    async def test_rejected_screenshot_can_be_resubmitted(self):
+        await self.db.review_screenshots(100, [(1, self.task_id)], False)
+        self.assertTrue(await self.db.save_screenshot(1, self.task_id, file_id='again'))
+        self.assertEqual(len(await self.db.review_screenshots(100, [(1, self.task_id)], True)), 1)
+        self.assertEqual(self.ledger(), {1: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()